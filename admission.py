@@ -0,0 +1,110 @@
+import time
+from collections import OrderedDict
+
+# Admission decisions
+ADMITTED = "admitted"
+NUMBER_RATE = "number_rate"
+GLOBAL_RATE = "global_rate"
+QUEUE_FULL = "queue_full"
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average, with bursts of up to `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def try_take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class AdmissionController:
+    """
+    Decides whether an incoming message may enter the processing pipeline.
+
+    A message is admitted only if its number's token bucket and the global
+    bucket both have a token and fewer than max_pending admitted messages
+    are still queued or running, across all connections. Callers must call
+    release() once for every admitted message when it is done.
+
+    Per-number buckets are kept for at most max_numbers numbers, least
+    recently active dropped first (a dropped number starts again with a
+    full bucket).
+    """
+
+    def __init__(self, number_rate=0.5, number_burst=5, global_rate=50, global_burst=200,
+                 max_pending=500, max_numbers=100000, notify_interval=60):
+        self.number_rate = number_rate
+        self.number_burst = number_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_pending = max_pending
+        self.max_numbers = max_numbers
+        self.notify_interval = notify_interval
+        self.pending = 0
+        self._numbers = OrderedDict()
+        self._notified = {}
+
+        self.admitted = 0
+        self.shed = {NUMBER_RATE: 0, GLOBAL_RATE: 0, QUEUE_FULL: 0}
+
+    def admit(self, phone_number):
+        """Return ADMITTED or the reason the message is shed."""
+        now = time.monotonic()
+        if self.pending >= self.max_pending:
+            return self._shed(QUEUE_FULL)
+
+        bucket = self._numbers.get(phone_number)
+        if bucket is None:
+            bucket = self._numbers[phone_number] = TokenBucket(self.number_rate, self.number_burst, now)
+            while len(self._numbers) > self.max_numbers:
+                self._numbers.popitem(last=False)
+        else:
+            self._numbers.move_to_end(phone_number)
+        if not bucket.try_take(now):
+            return self._shed(NUMBER_RATE)
+
+        if not self.global_bucket.try_take(now):
+            # Give the number its token back; it was not the one at fault
+            bucket.tokens += 1
+            return self._shed(GLOBAL_RATE)
+
+        self.pending += 1
+        self.admitted += 1
+        return ADMITTED
+
+    def _shed(self, reason):
+        self.shed[reason] += 1
+        return reason
+
+    def release(self, count=1):
+        self.pending = max(self.pending - count, 0)
+
+    def should_notify(self, phone_number):
+        """
+        Whether a shed message should get the canned busy reply. A number
+        hears it at most once per notify_interval, so a flood of messages
+        doesn't turn into a flood of replies.
+        """
+        now = time.monotonic()
+        last = self._notified.get(phone_number)
+        if last is not None and now - last < self.notify_interval:
+            return False
+        self._notified[phone_number] = now
+        if len(self._notified) > self.max_numbers:
+            cutoff = now - self.notify_interval
+            self._notified = {number: at for number, at in self._notified.items() if at >= cutoff}
+        return True
+
+    def stats(self):
+        return {"admitted": self.admitted, "pending": self.pending, **{f"shed_{k}": v for k, v in self.shed.items()}}
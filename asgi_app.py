@@ -0,0 +1,107 @@
+"""
+Single-process deployment: an ASGI app that receives Twilio webhooks and
+runs the bot pipeline on its own event loop, with no connector process and
+no WebSocket hop in between.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 4000
+
+The two-service setup (twilio_connector.py + whatsapp_bot.py) keeps working
+unchanged; use whichever fits the deployment.
+"""
+import os
+import time
+import asyncio
+from urllib.parse import parse_qs
+from twilio.twiml.messaging_response import MessagingResponse
+import metrics
+from admission import ADMITTED
+from whatsapp_bot import (
+    process_message, format_whatsapp_response, storage, history_manager, admission, shed_reply, current_deadline
+)
+
+WEBHOOK_TIMEOUT = int(os.getenv("WEBHOOK_TIMEOUT", 30))
+
+TEXT_HEADERS = [(b"content-type", b"text/plain; charset=utf-8")]
+TWIML_HEADERS = [(b"content-type", b"application/xml; charset=utf-8")]
+METRICS_HEADERS = [(b"content-type", b"text/plain; version=0.0.4; charset=utf-8")]
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def respond(send, status, body, headers=TEXT_HEADERS):
+    if isinstance(body, str):
+        body = body.encode()
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def webhook(receive, send):
+    """Twilio webhook endpoint: reply to a WhatsApp message with TwiML."""
+    form = parse_qs((await read_body(receive)).decode())
+    from_number = form.get("From", [None])[0]
+    message_body = form.get("Body", [None])[0]
+
+    if not from_number or not message_body:
+        response = MessagingResponse()
+        response.message("Error: Could not process your message.")
+        return await respond(send, 200, str(response), TWIML_HEADERS)
+
+    decision = admission.admit(from_number)
+    if decision != ADMITTED:
+        return await respond(send, 200, shed_reply(from_number, decision), TWIML_HEADERS)
+
+    # Gemini retries and hedges stop at the deadline; wait_for cancels the
+    # generation once it passes
+    current_deadline.set(time.time() + WEBHOOK_TIMEOUT)
+    try:
+        with metrics.span("handle_message"):
+            twiml = await asyncio.wait_for(process_message(from_number, message_body), timeout=WEBHOOK_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Reply to {from_number} timed out")
+        metrics.inc("fallback_replies_total", reason="timeout")
+        twiml = format_whatsapp_response("I'm sorry, our service is temporarily unavailable. Please try again later.")
+    finally:
+        admission.release()
+    await respond(send, 200, twiml, TWIML_HEADERS)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await history_manager.close()
+            await storage.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/health" and method == "GET":
+        return await respond(send, 200, "OK")
+    if path == "/metrics" and method == "GET":
+        return await respond(send, 200, metrics.render(), METRICS_HEADERS)
+    if path == "/webhook":
+        if method != "POST":
+            return await respond(send, 405, "Method Not Allowed")
+        return await webhook(receive, send)
+    await respond(send, 404, "Not Found")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 4000)))
@@ -0,0 +1,89 @@
+"""
+Connector throughput: one WebSocket per webhook vs. the persistent pool.
+
+Starts a stub bot server that answers every message after a fixed delay,
+then pushes messages through twilio_connector.send_to_websocket from many
+threads (like gunicorn threads would) in both modes and prints msgs/s.
+
+    python benchmarks/bench_connector_pool.py --messages 2000 --threads 32
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websockets
+
+STUB_PORT = 8799
+os.environ.setdefault("WEBSOCKET_URL", f"ws://127.0.0.1:{STUB_PORT}")
+
+import twilio_connector  # noqa: E402
+from twilio_connector import send_to_websocket_unpooled  # noqa: E402
+from ws_pool import WebSocketPool  # noqa: E402
+
+
+def start_stub_server(delay):
+    """Run a bot stand-in that replies to each message concurrently."""
+    ready = threading.Event()
+
+    async def reply(websocket, raw):
+        data = json.loads(raw)
+        await asyncio.sleep(delay)
+        body = f"<Response><Message>echo {data['Body']}</Message></Response>"
+        if "id" in data:
+            await websocket.send(json.dumps({"id": data["id"], "Body": body}))
+        else:
+            await websocket.send(body)
+
+    async def handler(websocket):
+        async for raw in websocket:
+            asyncio.create_task(reply(websocket, raw))
+
+    async def serve():
+        async with websockets.serve(handler, "127.0.0.1", STUB_PORT, max_queue=None):
+            ready.set()
+            await asyncio.Future()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    ready.wait()
+
+
+def run(send, messages, threads):
+    def one(i):
+        reply = send(f"whatsapp:+9190000{i % 500:05d}", f"hello {i}")
+        return reply is not None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        ok = sum(executor.map(one, range(messages)))
+    elapsed = time.perf_counter() - start
+    return ok, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=0.0, help="stub reply delay in seconds")
+    args = parser.parse_args()
+
+    start_stub_server(args.delay)
+
+    ok, elapsed = run(send_to_websocket_unpooled, args.messages, args.threads)
+    print(f"per-message connection: {ok}/{args.messages} ok, {args.messages / elapsed:8.1f} msgs/s")
+
+    pool = WebSocketPool(twilio_connector.WEBSOCKET_URL, size=args.pool_size)
+    ok, elapsed = run(pool.send, args.messages, args.threads)
+    print(f"pooled ({args.pool_size} sockets):     {ok}/{args.messages} ok, {args.messages / elapsed:8.1f} msgs/s")
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
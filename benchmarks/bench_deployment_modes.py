@@ -0,0 +1,113 @@
+"""
+Webhook latency: two services (Flask connector -> WebSocket -> bot) vs. the
+single-process ASGI app.
+
+Starts each deployment as subprocesses with the fake Gemini client, posts
+Twilio-style webhooks from many threads and prints p50/p99 latency and
+throughput for both.
+
+    python benchmarks/bench_deployment_modes.py --messages 2000 --threads 32 --llm-latency 0.05
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_PORT = 8765
+CONNECTOR_PORT = 4100
+ASGI_PORT = 4101
+
+
+def start(command, env):
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_healthy(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become healthy")
+
+
+def run(url, messages, threads):
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        response = session.post(url, data={"From": f"whatsapp:+9190000{i % 500:05d}", "Body": f"hello {i}"})
+        elapsed = time.perf_counter() - start
+        return elapsed if response.status_code == 200 and "<Message>" in response.text else None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(one, range(messages)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(r for r in results if r is not None)
+    if not latencies:
+        return 0, wall, 0.0, 0.0
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return len(latencies), wall, p50, p99
+
+
+def report(label, messages, result):
+    ok, wall, p50, p99 = result
+    print(f"{label:14s} {ok}/{messages} ok  {messages / wall:8.1f} msgs/s  p50 {p50 * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake Gemini latency in seconds")
+    args = parser.parse_args()
+
+    env = dict(os.environ, USE_FAKE_GEMINI="1", FAKE_GEMINI_LATENCY=str(args.llm_latency),
+               WEBSOCKET_URL=f"ws://127.0.0.1:{BOT_PORT}", PYTHONUNBUFFERED="1")
+    # Messages arrive far faster than admission control lets through by
+    # default, and shed "busy" replies would be timed as answers, so the
+    # limits are lifted unless set explicitly (as in load_test.py)
+    for name in ("RATE_LIMIT_PER_NUMBER", "RATE_LIMIT_PER_NUMBER_BURST", "RATE_LIMIT_GLOBAL", "RATE_LIMIT_GLOBAL_BURST"):
+        env.setdefault(name, "1000000")
+
+    processes = [
+        start([sys.executable, "whatsapp_bot.py"], env),
+        start([sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{CONNECTOR_PORT}",
+               "--workers", "1", "--threads", str(args.threads), "twilio_connector:app"], env),
+    ]
+    try:
+        wait_healthy(f"http://127.0.0.1:{CONNECTOR_PORT}/health")
+        time.sleep(1)  # let the bot finish binding its WebSocket port
+        report("two services", args.messages, run(f"http://127.0.0.1:{CONNECTOR_PORT}/webhook", args.messages, args.threads))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    process = start([sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1",
+                     "--port", str(ASGI_PORT), "--log-level", "warning"], env)
+    try:
+        wait_healthy(f"http://127.0.0.1:{ASGI_PORT}/health")
+        report("asgi", args.messages, run(f"http://127.0.0.1:{ASGI_PORT}/webhook", args.messages, args.threads))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    main()
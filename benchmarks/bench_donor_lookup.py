@@ -0,0 +1,126 @@
+"""
+Donor lookup: the original linear-scan get_user_id_from_info vs. DonorRepository.
+
+Generates a synthetic donor base (default 10^5 donors with 1-3 donations
+each) and times phone, UTR and name lookups with both implementations.
+
+    python benchmarks/bench_donor_lookup.py --donors 100000
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from donor_repository import DonorRepository  # noqa: E402
+
+FIRST_NAMES = ["Rajesh", "Priya", "Amit", "Sneha", "Arvin", "Kavita", "Suresh", "Anita", "Vikram", "Meera"]
+LAST_NAMES = ["Sharma", "Patel", "Verma", "Gupta", "Kumar", "Singh", "Iyer", "Reddy", "Nair", "Das"]
+
+
+def legacy_get_user_id(extracted_info, phone_number, donations_by_id, phone_numbers):
+    """The lookup as it was before DonorRepository, minus the random fallback."""
+    clean_phone = None
+    if phone_number:
+        if phone_number.startswith("whatsapp:"):
+            phone_number = phone_number[9:]
+        clean_phone = re.sub(r'\s+', '', phone_number)
+
+    if clean_phone:
+        for id, phone in phone_numbers.items():
+            if clean_phone in phone.replace(" ", ""):
+                return id
+
+    if extracted_info["utr"]:
+        for id, donations in donations_by_id.items():
+            if any(d.get("utr", "") == extracted_info["utr"] for d in donations):
+                return id
+
+    if extracted_info["name"]:
+        for id, donations in donations_by_id.items():
+            if donations and any(extracted_info["name"].lower() in d.get("donor_name", "").lower() for d in donations):
+                return id
+
+    return None
+
+
+def make_donors(count):
+    donations, phones = {}, {}
+    for donor_id in range(1, count + 1):
+        number = f"{7000000000 + donor_id * 7:010d}"
+        phones[donor_id] = f"+91 {number[:5]} {number[5:]}"
+        name = f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}{donor_id}"
+        donations[donor_id] = [
+            {"amount": random.randint(100, 50000), "date": "2025-03-02", "utr": f"UTR{donor_id:07d}{n}",
+             "receipt_sent": bool(n % 2), "donor_name": name, "payment_method": "UPI", "campaign": "Education Fund"}
+            for n in range(random.randint(1, 3))
+        ]
+    return donations, phones
+
+
+def timed(label, fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(*query)
+    per_call = (time.perf_counter() - start) / len(queries)
+    print(f"  {label:10s} {per_call * 1e6:12.1f} us/lookup")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--donors", type=int, default=100000)
+    parser.add_argument("--legacy-lookups", type=int, default=20)
+    parser.add_argument("--indexed-lookups", type=int, default=100000)
+    args = parser.parse_args()
+
+    random.seed(7)
+    donations, phones = make_donors(args.donors)
+
+    start = time.perf_counter()
+    repository = DonorRepository.from_tables(donations, phones)
+    print(f"Index build for {args.donors} donors: {(time.perf_counter() - start) * 1e3:.0f} ms")
+
+    def sample(n):
+        ids = [random.randint(1, args.donors) for _ in range(n)]
+        return {
+            "phone": [({"utr": None, "name": None}, "whatsapp:" + phones[i].replace(" ", "")) for i in ids],
+            "utr": [({"utr": donations[i][0]["utr"], "name": None}, "whatsapp:+10000000000") for i in ids],
+            "name": [({"utr": None, "name": donations[i][0]["donor_name"].split()[1]}, None) for i in ids],
+            # Same local number under another country code, and with none at all
+            "country": [({"utr": None, "name": None}, f"whatsapp:+{code}{phones[i][4:].replace(' ', '')}")
+                        for i in ids for code in ("44", "1")],
+            "bare": [({"utr": None, "name": None}, phones[i][4:]) for i in ids],
+        }
+
+    def indexed(extracted_info, phone_number):
+        if phone_number:
+            user_id = repository.find_by_phone(phone_number)
+            if user_id is not None:
+                return user_id
+        if extracted_info["utr"]:
+            user_id = repository.find_by_utr(extracted_info["utr"])
+            if user_id is not None:
+                return user_id
+        if extracted_info["name"]:
+            return repository.find_by_name(extracted_info["name"])
+        return None
+
+    legacy_queries = sample(args.legacy_lookups)
+    for kind, queries in legacy_queries.items():
+        for extracted_info, phone_number in queries:
+            assert legacy_get_user_id(extracted_info, phone_number, donations, phones) == indexed(extracted_info, phone_number)
+
+    indexed_queries = sample(args.indexed_lookups)
+    for kind in ("phone", "utr", "name"):
+        print(f"{kind} lookup:")
+        legacy = timed("legacy", lambda e, p: legacy_get_user_id(e, p, donations, phones), legacy_queries[kind])
+        fast = timed("indexed", indexed, indexed_queries[kind])
+        print(f"  speedup    {legacy / fast:12.0f}x")
+
+
+if __name__ == "__main__":
+    main()
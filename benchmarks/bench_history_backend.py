@@ -0,0 +1,101 @@
+"""
+Read/write latency of the history backends under concurrent load.
+
+Each simulated donor repeatedly reads its history and the reply cache,
+then records a new turn, the same calls the bot makes per message. The
+SQLite backend can also be driven from several processes sharing one
+database file, as several bot workers would.
+
+    python benchmarks/bench_history_backend.py --donors 200 --rounds 20 --processes 4
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import create_storage  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def drive(storage, worker, donors, rounds):
+    reads, writes = [], []
+
+    async def donor(n):
+        phone = f"whatsapp:+91{worker}{n:09d}"
+        for i in range(rounds):
+            start = time.perf_counter()
+            await storage.get_history(phone)
+            await storage.get_cached_response(f"{phone}:message {i}")
+            reads.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await storage.append_turn(phone, f"message {i}", "Namaste! " + "x" * random.randint(50, 400))
+            await storage.cache_response(f"{phone}:message {i}", "<Response/>")
+            writes.append(time.perf_counter() - start)
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(donor(n) for n in range(donors)))
+    await storage.close()
+    return reads, writes, time.perf_counter() - start
+
+
+def run_worker(kind, path, worker, donors, rounds, results):
+    storage = create_storage(kind, path=path)
+    results.put(asyncio.run(drive(storage, worker, donors, rounds)))
+
+
+def report(label, results):
+    reads = [r for result in results for r in result[0]]
+    writes = [w for result in results for w in result[1]]
+    elapsed = max(result[2] for result in results)
+    ops = len(reads) + len(writes)
+    print(f"{label:28s} {ops / elapsed:10.0f} ops/s   "
+          f"read p50 {percentile(reads, 50) * 1e3:6.2f} ms  p99 {percentile(reads, 99) * 1e3:6.2f} ms   "
+          f"write p50 {percentile(writes, 50) * 1e3:6.3f} ms  p99 {percentile(writes, 99) * 1e3:6.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--donors", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    storage = create_storage("memory")
+    report("memory (1 process)", [asyncio.run(drive(storage, 0, args.donors, args.rounds))])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        storage = create_storage("sqlite", path=path)
+        report("sqlite (1 process)", [asyncio.run(drive(storage, 0, args.donors, args.rounds))])
+
+        path = os.path.join(directory, "bench-shared.db")
+        create_storage("sqlite", path=path)
+        queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=run_worker, args=("sqlite", path, w, args.donors, args.rounds, queue))
+            for w in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        results = [queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        report(f"sqlite ({args.processes} processes)", results)
+
+
+if __name__ == "__main__":
+    main()
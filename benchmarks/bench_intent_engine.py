@@ -0,0 +1,187 @@
+"""
+Intent and entity extraction: the original identify_intent/extract_info_from_query
+vs. the single-pass MessageAnalyzer.
+
+First checks that both give identical results on a golden corpus plus a
+seeded random corpus built from keywords, names and number formats, then
+times both per message.
+
+    python benchmarks/bench_intent_engine.py --fuzz 20000
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_engine import MessageAnalyzer, INTENT_RULES, NAME_INDICATORS, COMMON_NAMES  # noqa: E402
+
+
+def legacy_identify_intent(query):
+    query_lower = query.lower()
+
+    if any(word in query_lower for word in ["donate", "contribution", "give", "support", "contribute", "payment"]):
+        return "donation_intent"
+    elif any(word in query_lower for word in ["receipt", "tax", "acknowledgment", "certificate", "80g"]) and any(word in query_lower for word in ["didn't get", "haven't received", "missing", "where", "not received"]):
+        return "receipt_issue"
+    elif any(word in query_lower for word in ["utr", "transaction", "payment", "confirm", "successful", "went through"]):
+        return "utr_verification"
+    elif any(word in query_lower for word in ["volunteer", "volunteering", "help out", "join", "participate"]):
+        return "volunteer_inquiry"
+    elif any(word in query_lower for word in ["tax benefit", "80g", "deduction", "tax exemption"]):
+        return "tax_benefit_inquiry"
+    elif any(word in query_lower for word in ["project", "campaign", "initiative", "program", "what do you do"]):
+        return "project_inquiry"
+    elif any(word in query_lower for word in ["office", "location", "address", "visit", "come to"]):
+        return "office_inquiry"
+    else:
+        return "general_inquiry"
+
+
+def legacy_extract_info_from_query(query):
+    utr_match = re.search(r'UTR\d+', query, re.IGNORECASE)
+    utr = utr_match.group(0) if utr_match else None
+
+    amount_match = re.search(r'₹\s*(\d+)', query) or re.search(r'Rs\.?\s*(\d+)', query) or re.search(r'(\d+)\s*rupees', query, re.IGNORECASE)
+    amount = amount_match.group(1) if amount_match else None
+
+    phone_match = re.search(r'(\+91\s?)?[789]\d{9}', query) or re.search(r'(\+91\s?)?[789]\d\d\d\d\s?\d\d\d\d\d', query)
+    phone = phone_match.group(0) if phone_match else None
+
+    name_indicators = ["name is", "this is", "called", "speaking", "named", "by the name"]
+    name = None
+    for indicator in name_indicators:
+        if indicator in query.lower():
+            parts = query.lower().split(indicator)
+            if len(parts) > 1:
+                potential_name = parts[1].strip().split()[0].capitalize()
+                if len(potential_name) > 2:
+                    name = potential_name
+                    break
+
+    common_names = ["Arvin", "Rajesh", "Priya", "Amit", "Sneha"]
+    for common_name in common_names:
+        if common_name.lower() in query.lower():
+            name = common_name
+            break
+
+    return {"utr": utr, "amount": amount, "phone": phone, "name": name}
+
+
+GOLDEN_CORPUS = [
+    "Hi",
+    "Namaste, I want to donate ₹5000 for the Education Fund",
+    "How can I contribute? My name is Kavita",
+    "I made a payment of Rs. 2500 yesterday, UTR789456",
+    "Did my transaction UTR123789 go through?",
+    "I haven't received my 80G receipt for the donation",
+    "Where is my tax receipt? This is Rajesh",
+    "My acknowledgment is missing, utr456123",
+    "I didn't get my certificate",
+    "Can I volunteer on weekends?",
+    "I'd like to help out with the clean water project",
+    "What tax benefit do I get?",
+    "Is there a deduction under 80g",
+    "Tell me about your tax exemption status",
+    "What do you do?",
+    "Which campaign needs help most right now",
+    "Where is your office located?",
+    "Can I come to visit on Saturday",
+    "What's your address",
+    "Hello, Priya here. Can you confirm my UTR987234",
+    "I sent 3000 rupees, was it successful?",
+    "Payment went through? call me on +91 9876543210",
+    "my number is 9780086800, name is arvin",
+    "this is amit speaking, phone +919876543210",
+    "I'm called Sneha and I paid Rs500",
+    "by the name of Suresh, sent 1000 Rupees",
+    "Please call 98765 43210 regarding my receipt, it's missing",
+    "I want to join as a volunteer",
+    "Is the healthcare initiative still running?",
+    "Location of your nearest center?",
+    "Thank you so much!",
+    "RS 400 is that ok",
+    "rs. 400 is that ok",
+    "₹ 10000 sent via UTR654321, receipt not received",
+    "Is 80G available? Where do I get it",
+    "I was named after my grandfather Vikram",
+    "speaking to whom? my name is Om",
+    "9876543210 rupees just kidding",
+    "forgive me, I forgot the transaction id",
+    "Do you support rural development programs",
+    "utr UTR111 utr222",
+    # Text that gets longer when lowercased ("İ" becomes "i" plus a combining dot)
+    "name İs Ravi",
+    "my name is İrfan, UTR123 ₹500",
+    "İ want to vİsit your office, call +91 9876543210",
+    "İİ sent 500 rupees for the project",
+    "this is ẞK, my payment",  # "ß" capitalizes to "Ss"
+]
+
+
+def fuzz_corpus(count, seed=7):
+    random.seed(seed)
+    vocabulary = [k for _, groups in INTENT_RULES for group in groups for k in group]
+    vocabulary += NAME_INDICATORS + COMMON_NAMES + [n.upper() for n in COMMON_NAMES]
+    vocabulary += ["hello", "please", "my", "is", "the", "to", "ok", "ji", "Kavita", "Om", "forgive", "taxes",
+                   "UTR", "utr", "Rs", "rs.", "₹", "rupees", "RUPEES", "+91", "80", "g", "?", ","]
+    numbers = ["9876543210", "98765 43210", "+919876543210", "+91 9876543210", "7123456789",
+               "812345678", "500", "1,000", "UTR789456", "utr42", "Rs.300", "₹250", "50rupees"]
+    messages = []
+    for _ in range(count):
+        words = [random.choice(vocabulary if random.random() < 0.8 else numbers) for _ in range(random.randint(1, 14))]
+        joiner = random.choice([" ", " ", " ", ""])
+        messages.append(joiner.join(words))
+    return messages
+
+
+def legacy(query):
+    info = legacy_extract_info_from_query(query)
+    info["intent"] = legacy_identify_intent(query)
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fuzz", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    analyzer = MessageAnalyzer()
+
+    corpus = GOLDEN_CORPUS + fuzz_corpus(args.fuzz)
+    compared = mismatches = 0
+    for query in corpus:
+        try:
+            expected = legacy(query)
+        except IndexError:
+            # The original crashes when a name phrase ends the message; the
+            # analyzer returns no name instead
+            continue
+        compared += 1
+        actual = analyzer.analyze(query)
+        if actual != expected:
+            mismatches += 1
+            print(f"MISMATCH {query!r}\n  legacy:   {expected}\n  analyzer: {actual}")
+    print(f"Compared {compared} messages, {mismatches} mismatches")
+
+    # Best of five runs, to keep scheduler noise out of the comparison
+    for label, fn in (("legacy", legacy), ("analyzer", analyzer.analyze)):
+        runs = []
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                for query in GOLDEN_CORPUS:
+                    fn(query)
+            runs.append((time.perf_counter() - start) / (args.repeat * len(GOLDEN_CORPUS)))
+        print(f"{label:10s} {min(runs) * 1e6:8.2f} us/message")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
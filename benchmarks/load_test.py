@@ -0,0 +1,486 @@
+"""
+Offline load test of the bot with fake Gemini and fake Twilio.
+
+Starts the chosen deployment as subprocesses (USE_FAKE_GEMINI=1, so no quota
+is spent) and drives it with a realistic traffic mix: new and returning
+donors, every intent class, and duplicate retries sent while the original
+is still in flight. Reports msgs/s, p50/p95/p99 latency per message kind
+and the servers' RSS growth over the run.
+
+Targets:
+  ws         the bot's WebSocket server on :8765 (JSON envelopes with ids)
+  connector  Flask /webhook under gunicorn, in front of the bot
+             (--reply-mode async delivers replies to a fake Twilio API and
+             latency is measured until the reply reaches it)
+  asgi       the single-process ASGI app
+
+Results can be saved as a named baseline and later runs compared with it:
+
+    python benchmarks/load_test.py --target ws --duration 60 --save-baseline ws
+    python benchmarks/load_test.py --target ws --duration 60 --compare ws
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import threading
+import subprocess
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("USE_FAKE_GEMINI", "1")
+
+import requests  # noqa: E402
+import websockets  # noqa: E402
+
+from fake_twilio import FakeTwilioServer  # noqa: E402
+from whatsapp_bot import DUMMY_DONATIONS, DONOR_PHONE_NUMBERS  # noqa: E402
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+BOT_PORT = 8765
+CONNECTOR_PORT = 4100
+ASGI_PORT = 4101
+
+INTENT_MESSAGES = {
+    "donation_intent": ["I want to donate ₹{amount} to the {campaign}", "How can I contribute?",
+                        "Can I give monthly support?"],
+    "receipt_issue": ["I haven't received my receipt for ₹{amount}", "Where is my 80G certificate?",
+                      "My tax receipt is missing"],
+    "utr_verification": ["Did my payment go through? {utr}", "Please confirm transaction {utr}",
+                         "Was my transfer successful?"],
+    "volunteer_inquiry": ["I'd like to volunteer on weekends", "Can my team participate in a drive?"],
+    "tax_benefit_inquiry": ["What tax benefit do I get?", "Is there a deduction for donors?"],
+    "project_inquiry": ["Tell me about the {campaign}", "What do you do?"],
+    "office_inquiry": ["Where is your office?", "Can I come to visit on Saturday?"],
+    "general_inquiry": ["Hello", "Thank you so much!", "Namaste ji, kaise ho?"],
+}
+CAMPAIGNS = ["Education Fund", "Healthcare Initiative", "Clean Water Project", "Summer Relief 2025"]
+
+
+class TrafficMix:
+    """
+    Seeded message generator. Each message is (kind, phone, body, duplicate)
+    where kind is "new"/"returning" plus the intent, and duplicate means the
+    same message is sent again while the first is in flight, like a Twilio
+    retry or a double tap.
+    """
+
+    def __init__(self, seed, new_ratio, duplicate_ratio):
+        self.random = random.Random(seed)
+        self.new_ratio = new_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.known = ["whatsapp:+91" + phone.replace("+91", "").replace(" ", "") for phone in DONOR_PHONE_NUMBERS.values()]
+        self.returning = list(self.known)
+        self.utrs = [d["utr"] for donations in DUMMY_DONATIONS.values() for d in donations]
+        self.next_number = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            if self.random.random() < self.new_ratio:
+                self.next_number += 1
+                phone = f"whatsapp:+9170{self.next_number:08d}"
+                self.returning.append(phone)
+                donor = "new"
+            else:
+                phone = self.random.choice(self.returning)
+                donor = "returning"
+            intent = self.random.choice(list(INTENT_MESSAGES))
+            body = self.random.choice(INTENT_MESSAGES[intent]).format(
+                amount=self.random.choice([500, 1000, 2500, 5000]),
+                campaign=self.random.choice(CAMPAIGNS),
+                utr=self.random.choice(self.utrs),
+            )
+            duplicate = self.random.random() < self.duplicate_ratio
+        return f"{donor}/{intent}", phone, body, duplicate
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, kind, latency):
+        with self.lock:
+            if latency is None:
+                self.errors[kind] += 1
+            else:
+                self.latencies[kind].append(latency)
+
+    def summary(self, wall):
+        def stats(values):
+            values = sorted(values)
+            if not values:
+                return {"count": 0}
+            pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]  # noqa: E731
+            return {"count": len(values), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+
+        everything = [v for values in self.latencies.values() for v in values]
+        total = len(everything) + sum(self.errors.values())
+        return {
+            "messages": total,
+            "errors": sum(self.errors.values()),
+            "msgs_per_s": total / wall if wall else 0.0,
+            "latency": stats(everything),
+            "by_kind": {kind: dict(stats(values), errors=self.errors.get(kind, 0))
+                        for kind, values in sorted(self.latencies.items())},
+        }
+
+
+# Server processes and memory
+
+def rss_kb(pid):
+    """Resident set size of a process and its children, from /proc (Linux)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, pids, interval=1.0):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.samples.append(sum(rss_kb(pid) for pid in self.pids))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        if not self.samples or not self.samples[0]:
+            return None
+        return {"start_mb": self.samples[0] / 1024, "peak_mb": max(self.samples) / 1024,
+                "end_mb": self.samples[-1] / 1024, "growth_mb": (self.samples[-1] - self.samples[0]) / 1024}
+
+
+def start(command, env):
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until(check, what, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{what} did not come up")
+
+
+def http_ok(url):
+    return requests.get(url, timeout=1).status_code == 200
+
+
+def start_servers(args, twilio_url):
+    env = dict(os.environ, USE_FAKE_GEMINI="1", FAKE_GEMINI_LATENCY=str(args.llm_latency),
+               FAKE_GEMINI_JITTER=str(args.llm_jitter), FAKE_GEMINI_FAILURE_RATE=str(args.llm_failure_rate),
+               WEBSOCKET_URL=f"ws://127.0.0.1:{BOT_PORT}", REPLY_MODE=args.reply_mode,
+               TWILIO_API_BASE_URL=twilio_url or "", TWILIO_ACCOUNT_SID="ACloadtest", TWILIO_AUTH_TOKEN="loadtest",
+               TWILIO_WHATSAPP_NUMBER="whatsapp:+14155238886", HISTORY_BACKEND=args.history_backend,
+               HISTORY_DB_PATH=os.path.join(ROOT, "loadtest.db"))
+    # The mix reuses a handful of known donor numbers far faster than a real
+    # donor types, so admission limits are lifted unless set explicitly
+    for name in ("RATE_LIMIT_PER_NUMBER", "RATE_LIMIT_PER_NUMBER_BURST", "RATE_LIMIT_GLOBAL", "RATE_LIMIT_GLOBAL_BURST"):
+        env.setdefault(name, "1000000")
+
+    if args.target == "asgi":
+        process = start([sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1",
+                         "--port", str(ASGI_PORT), "--log-level", "warning"], env)
+        wait_until(lambda: http_ok(f"http://127.0.0.1:{ASGI_PORT}/health"), "ASGI app")
+        return [process]
+
+    if args.bot_workers:
+        processes = [start([sys.executable, "supervisor.py"], dict(env, WORKERS=str(args.bot_workers)))]
+    else:
+        processes = [start([sys.executable, "whatsapp_bot.py"], env)]
+    wait_until(lambda: http_ok(f"http://127.0.0.1:{BOT_PORT}/{'health' if args.bot_workers else 'metrics'}"), "bot")
+    if args.target == "connector":
+        processes.append(start([sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{CONNECTOR_PORT}",
+                                "--workers", str(args.workers), "--threads", str(args.concurrency),
+                                "twilio_connector:app"], env))
+        wait_until(lambda: http_ok(f"http://127.0.0.1:{CONNECTOR_PORT}/health"), "connector")
+    return processes
+
+
+# Drivers
+
+def run_http(url, mix, results, args, deliveries=None):
+    """Closed loop: each thread sends a message, waits for the reply, repeats."""
+    deadline = time.time() + args.duration if args.duration else None
+    remaining = [args.messages]
+    remaining_lock = threading.Lock()
+    local = threading.local()
+
+    def take():
+        with remaining_lock:
+            if deadline is not None:
+                return time.time() < deadline
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def send(kind, phone, body):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        waiter = deliveries.expect(phone) if deliveries else None
+        begin = time.perf_counter()
+        try:
+            response = session.post(url, data={"From": phone, "Body": body, "To": "whatsapp:+14155238886"},
+                                    timeout=args.timeout)
+            ok = response.status_code == 200
+            if waiter is not None:
+                ok = ok and waiter.wait(args.timeout)
+            else:
+                ok = ok and "<Message>" in response.text
+        except requests.RequestException:
+            ok = False
+        results.add(kind, time.perf_counter() - begin if ok else None)
+
+    def worker():
+        retries = ThreadPoolExecutor(max_workers=1)
+        while take():
+            kind, phone, body, duplicate = mix.next()
+            retry = None
+            if duplicate:
+                retry = retries.submit(lambda: (time.sleep(args.retry_delay), send("duplicate", phone, body)))
+            send(kind, phone, body)
+            if retry is not None:
+                retry.result()
+        retries.shutdown()
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+async def run_ws(url, mix, results, args):
+    """Closed loop over a few shared WebSocket connections, replies matched by id."""
+    connections = [await websockets.connect(url, max_size=None) for _ in range(args.connections)]
+    pending = {}
+    ids = iter(range(1 << 62))
+
+    async def reader(websocket):
+        async for raw in websocket:
+            future = pending.pop(json.loads(raw).get("id"), None)
+            if future and not future.done():
+                future.set_result(raw)
+
+    readers = [asyncio.create_task(reader(ws)) for ws in connections]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.duration if args.duration else None
+    remaining = [args.messages]
+
+    async def send(kind, phone, body):
+        request_id = str(next(ids))
+        future = pending[request_id] = loop.create_future()
+        begin = time.perf_counter()
+        try:
+            await random.choice(connections).send(json.dumps({"id": request_id, "From": phone, "Body": body}))
+            raw = await asyncio.wait_for(future, args.timeout)
+            ok = "<Message>" in raw
+        except Exception:
+            pending.pop(request_id, None)
+            ok = False
+        results.add(kind, time.perf_counter() - begin if ok else None)
+
+    async def worker():
+        while True:
+            if deadline is not None:
+                if loop.time() >= deadline:
+                    return
+            elif remaining[0] <= 0:
+                return
+            else:
+                remaining[0] -= 1
+            kind, phone, body, duplicate = mix.next()
+            if duplicate:
+                async def retry():
+                    await asyncio.sleep(args.retry_delay)
+                    await send("duplicate", phone, body)
+                await asyncio.gather(send(kind, phone, body), retry())
+            else:
+                await send(kind, phone, body)
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    for task in readers:
+        task.cancel()
+    for websocket in connections:
+        await websocket.close()
+
+
+class Deliveries:
+    """
+    Matches replies arriving at the fake Twilio API to waiting senders.
+    The bot answers each number in order, so a FIFO per number suffices.
+    """
+
+    def __init__(self):
+        self.waiters = defaultdict(deque)
+        self.lock = threading.Lock()
+
+    def expect(self, phone):
+        event = threading.Event()
+        with self.lock:
+            self.waiters[phone].append(event)
+        return event
+
+    def on_message(self, message):
+        with self.lock:
+            queue = self.waiters.get(message["to"])
+            event = queue.popleft() if queue else None
+        if event is not None:
+            event.set()
+
+
+# Reporting and baselines
+
+def print_report(summary):
+    latency = summary["latency"]
+    print(f"\n{summary['messages']} messages, {summary['errors']} errors, {summary['msgs_per_s']:.1f} msgs/s")
+    if latency.get("count"):
+        print(f"latency p50 {latency['p50'] * 1000:.1f} ms  p95 {latency['p95'] * 1000:.1f} ms  p99 {latency['p99'] * 1000:.1f} ms")
+    print(f"\n{'kind':36s} {'count':>7s} {'errors':>6s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for kind, stats in summary["by_kind"].items():
+        if stats["count"]:
+            print(f"{kind:36s} {stats['count']:7d} {stats['errors']:6d} {stats['p50'] * 1000:8.1f} "
+                  f"{stats['p95'] * 1000:8.1f} {stats['p99'] * 1000:8.1f}")
+    memory = summary.get("memory")
+    if memory:
+        print(f"\nserver RSS {memory['start_mb']:.1f} MB -> {memory['end_mb']:.1f} MB "
+              f"(peak {memory['peak_mb']:.1f} MB, growth {memory['growth_mb']:+.1f} MB)")
+
+
+def compare(summary, baseline, tolerance):
+    """Print changes against a baseline and return the list of regressions."""
+    regressions = []
+    checks = [("msgs/s", summary["msgs_per_s"], baseline["msgs_per_s"], False)]
+    for q in ("p50", "p95", "p99"):
+        if q in summary["latency"] and q in baseline["latency"]:
+            checks.append((f"{q} latency", summary["latency"][q], baseline["latency"][q], True))
+    if summary.get("memory") and baseline.get("memory"):
+        checks.append(("RSS growth MB", summary["memory"]["growth_mb"], baseline["memory"]["growth_mb"], True))
+
+    print(f"\nCompared with baseline {baseline['name']!r} ({baseline['saved_at']}):")
+    for label, now, before, lower_is_better in checks:
+        change = (now - before) / before if before else 0.0
+        worse = change > tolerance if lower_is_better else change < -tolerance
+        if label == "RSS growth MB":
+            worse = now - before > max(before * tolerance, 10)
+        flag = "  REGRESSION" if worse else ""
+        print(f"  {label:14s} {before:10.4f} -> {now:10.4f} ({change:+.1%}){flag}")
+        if worse:
+            regressions.append(label)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--target", choices=["ws", "connector", "asgi"], default="ws")
+    parser.add_argument("--reply-mode", choices=["sync", "async"], default="sync", help="connector reply mode")
+    parser.add_argument("--messages", type=int, default=2000, help="ignored when --duration is set")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--connections", type=int, default=4, help="WebSocket connections for --target ws")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers for --target connector")
+    parser.add_argument("--bot-workers", type=int, default=0,
+                        help="run the bot as supervisor.py with this many worker processes")
+    parser.add_argument("--new-ratio", type=float, default=0.3)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05)
+    parser.add_argument("--retry-delay", type=float, default=0.02)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--history-backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change before flagging")
+    args = parser.parse_args()
+
+    deliveries = twilio = None
+    if args.target == "connector" and args.reply_mode == "async":
+        deliveries = Deliveries()
+        twilio = FakeTwilioServer(on_message=deliveries.on_message).start()
+
+    mix = TrafficMix(args.seed, args.new_ratio, args.duplicate_ratio)
+    results = Results()
+    processes = start_servers(args, twilio.url if twilio else None)
+    sampler = MemorySampler([p.pid for p in processes])
+    try:
+        sampler.start()
+        begin = time.perf_counter()
+        if args.target == "ws":
+            asyncio.run(run_ws(f"ws://127.0.0.1:{BOT_PORT}", mix, results, args))
+        else:
+            port = CONNECTOR_PORT if args.target == "connector" else ASGI_PORT
+            run_http(f"http://127.0.0.1:{port}/webhook", mix, results, args, deliveries)
+        wall = time.perf_counter() - begin
+        memory = sampler.stop()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if twilio:
+            twilio.stop()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(os.path.join(ROOT, "loadtest.db" + suffix))
+            except OSError:
+                pass
+
+    summary = results.summary(wall)
+    summary["memory"] = memory
+    print_report(summary)
+
+    regressions = []
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        baseline = dict(summary, name=args.save_baseline, saved_at=time.strftime("%Y-%m-%d %H:%M:%S"),
+                        args=vars(args), python=platform.python_version(), machine=platform.platform(),
+                        cpus=os.cpu_count())
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {path}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
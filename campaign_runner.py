@@ -0,0 +1,418 @@
+"""
+Bulk outbound messages: receipt reminders, campaign appeals and thank-you
+notes, personalised by Gemini and sent through the Twilio Messages API.
+
+    python campaign_runner.py receipts
+    python campaign_runner.py campaign --campaign "Education Fund"
+    python campaign_runner.py thanks --synthetic 5000 --fake-twilio
+
+Donors are selected lazily from the donor repository and flow through two
+bounded stages: up to --concurrency messages are generated at once, and
+--send-workers threads post them at no more than --send-rate per second.
+Every request shares one prompt prefix (the receptionist persona plus the
+brief for this kind of message), registered as Gemini cached content, so
+each call only carries the donor's own details.
+
+Messages go to whatsapp:+<E.164 digits> of the stored number (see
+donor_repository.normalize_phone).
+
+WhatsApp only delivers free-form text to donors who messaged the bot in the
+last 24 hours; anything else needs a template approved by Meta. Pass its
+Content SID as --content-sid and every message is sent as that template,
+with {{1}} set to the donor's name and {{2}} to the generated text. Without
+one, donors with no message in the bot's history (HISTORY_BACKEND=sqlite,
+shared with the bot) within the window are skipped and counted as
+outside_window, since Twilio would reject them. --dry-run and --fake-twilio
+only count them.
+
+Each finished message is appended to a JSONL checkpoint. Running the same
+command again skips everything already sent, so a crashed run resumes where
+it stopped; failures and donors outside the window are retried. A message
+sent just before a crash but not yet recorded can be sent twice.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from google.genai import types
+import metrics
+from admission import TokenBucket
+from donor_repository import DonorRepository, normalize_phone
+from donor_context import render_donation
+from outbound import MessageSender, TwilioRestSender
+from prompt_cache import PromptCache, cache_is_missing
+from whatsapp_bot import (
+    client, storage, generate_content, GEMINI_MODEL, ENABLE_CONTEXT_CACHE, CONTEXT_CACHE_TTL, STATIC_SYSTEM_INSTRUCTION,
+    CURRENT_CAMPAIGNS, RECEIPTS_EMAIL, DUMMY_DONATIONS, DONOR_PHONE_NUMBERS, DONOR_EMAILS
+)
+
+RECEIPTS = "receipts"
+CAMPAIGN = "campaign"
+THANKS = "thanks"
+
+SESSION_WINDOW = 24 * 3600
+
+OUTBOUND_INSTRUCTION = """
+You are now writing one outbound WhatsApp message that Ananya sends to a donor
+first, not a reply. Write only the message text, in under 80 words, addressed
+to the donor by name. Do not invent amounts, dates or UTR numbers beyond the
+ones given.
+"""
+
+BRIEFS = {
+    RECEIPTS: f"""Purpose: let the donor know the 80G receipt for the donation below is
+still pending, apologise for the delay, say it will be emailed within 24 hours,
+and give {RECEIPTS_EMAIL} for questions.""",
+    CAMPAIGN: """Purpose: invite the donor to support the campaign named in the request.
+If they have given before, thank them for it first. Include the donation link
+https://donate.narayanss.org.""",
+    THANKS: """Purpose: thank the donor for their most recent donation below and say
+briefly what it helps the campaign achieve.""",
+}
+
+
+# Selection
+
+def whatsapp_address(phone):
+    """Return "whatsapp:+<E.164 digits>" for a stored phone number, or None."""
+    number = normalize_phone(phone)
+    return f"whatsapp:+{number}" if number else None
+
+
+def donor_name(donor):
+    for donation in donor["donations"]:
+        if donation.get("donor_name"):
+            return donation["donor_name"]
+    return None
+
+
+def select_targets(repository, kind, campaign=None):
+    """Yield one target per message to send, without building the full list."""
+    for donor_id, donor in list(repository.donors.items()):
+        to = whatsapp_address(donor.get("phone"))
+        if to is None:
+            continue
+        donations = donor["donations"]
+        target = {"donor_id": donor_id, "to": to, "name": donor_name(donor), "email": donor.get("email")}
+        if kind == RECEIPTS:
+            for donation in donations:
+                if not donation.get("receipt_sent"):
+                    yield dict(target, key=f"receipts:{donation['utr']}", donations=[donation])
+        elif kind == THANKS:
+            if donations:
+                latest = max(donations, key=lambda d: d.get("date", ""))
+                yield dict(target, key=f"thanks:{latest['utr']}", donations=[latest])
+        else:
+            yield dict(target, key=f"campaign:{campaign}:{donor_id}", donations=donations, campaign=campaign)
+
+
+def synthetic_repository(count, seed=1):
+    """The dummy donors plus `count` generated ones, for trial runs at scale."""
+    repository = DonorRepository.from_tables(DUMMY_DONATIONS, DONOR_PHONE_NUMBERS, DONOR_EMAILS)
+    rng = random.Random(seed)
+    first = ["Aarav", "Diya", "Kabir", "Meera", "Rohan", "Isha", "Vikram", "Anjali", "Sanjay", "Pooja"]
+    last = ["Sharma", "Patel", "Iyer", "Reddy", "Singh", "Nair", "Gupta", "Das", "Joshi", "Mehta"]
+    for i in range(count):
+        donor_id = 1000 + i
+        name = f"{rng.choice(first)} {rng.choice(last)}"
+        donations = [
+            {"amount": rng.choice([500, 1000, 2500, 5000, 10000]),
+             "date": f"2025-{rng.randint(1, 4):02d}-{rng.randint(1, 28):02d}",
+             "utr": f"UTR{donor_id:06d}{n}", "receipt_sent": rng.random() > 0.3, "donor_name": name,
+             "payment_method": rng.choice(["UPI", "Bank Transfer", "Credit Card"]),
+             "campaign": rng.choice(CURRENT_CAMPAIGNS)}
+            for n in range(rng.randint(0, 3))
+        ]
+        repository.upsert_donor(donor_id, phone=f"+91 7{donor_id:09d}",
+                                email=f"donor{donor_id}@example.com", donations=donations)
+    return repository
+
+
+# Checkpoint
+
+class Checkpoint:
+    """
+    Append-only JSONL log of finished messages. Keys logged as "sent" are
+    skipped on the next run; a line cut short by a crash is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sent = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if entry.get("status") == "sent":
+                        self.sent.add(entry["key"])
+        self._file = open(path, "a")
+
+    def __contains__(self, key):
+        return key in self.sent
+
+    def record(self, key, status, **fields):
+        if status == "sent":
+            self.sent.add(key)
+        self._file.write(json.dumps(dict(fields, key=key, status=status, at=time.time())) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# Sending
+
+class PrintSender(MessageSender):
+    """Prints messages instead of sending them (--dry-run)."""
+
+    def send(self, to, body, from_number=None, content_sid=None, content_variables=None):
+        template = f" (template {content_sid})" if content_sid else ""
+        print(f"--- to {to}{template}\n{body}\n")
+        return None
+
+
+class CampaignRunner:
+    """
+    Generates and sends one message per target. Without content_sid, targets
+    with no inbound message in history within SESSION_WINDOW are counted as
+    outside_window, and skipped too if enforce_window is set.
+    """
+
+    def __init__(self, kind, targets, checkpoint, sender, concurrency=32, send_rate=20, send_workers=8,
+                 content_sid=None, history=None, enforce_window=True):
+        self.kind = kind
+        self.targets = targets
+        self.checkpoint = checkpoint
+        self.sender = sender
+        self.content_sid = content_sid
+        self.history = history
+        self.enforce_window = enforce_window
+        self.concurrency = concurrency
+        self.send_bucket = TokenBucket(send_rate, max(1, int(send_rate)))
+        self.send_workers = send_workers
+        self.prompt_cache = PromptCache(client, GEMINI_MODEL, STATIC_SYSTEM_INSTRUCTION + OUTBOUND_INSTRUCTION + BRIEFS[kind],
+                                        ttl_seconds=CONTEXT_CACHE_TTL)
+
+        self.counts = {"selected": 0, "skipped": 0, "outside_window": 0, "generated": 0, "generate_failed": 0,
+                       "sent": 0, "send_failed": 0}
+        self.generate_times = []
+        self.send_times = []
+
+    def request_text(self, target):
+        lines = [f"Donor: {target['name'] or 'a supporter of the foundation'}"]
+        if target.get("email"):
+            lines.append(f"Email: {target['email']}")
+        if target.get("campaign"):
+            lines.append(f"Campaign: {target['campaign']}")
+        if target["donations"]:
+            lines.append("Donations:")
+            lines.extend(render_donation(d).rstrip() for d in target["donations"])
+        else:
+            lines.append("No donations yet.")
+        return "\n".join(lines)
+
+    async def in_session(self, target):
+        """Whether the donor has messaged the bot within the last SESSION_WINDOW seconds."""
+        if self.history is None:
+            return False
+        messages = await self.history.get_history(target["to"])
+        last = max((m.get("at", 0) for m in messages if m["role"] == "user"), default=0)
+        return time.time() - last < SESSION_WINDOW
+
+    def template_variables(self, target, body):
+        # Template parameters can't contain newlines or runs of spaces
+        return {"1": target["name"] or "there", "2": " ".join(body.split())}
+
+    async def generate(self, target):
+        """Return the message text for a target."""
+        text = self.request_text(target)
+        cache_name = await self.prompt_cache.get_name() if ENABLE_CONTEXT_CACHE else None
+        if cache_name:
+            config = types.GenerateContentConfig(cached_content=cache_name, temperature=0.7, max_output_tokens=300)
+            try:
+                response = await generate_content(GEMINI_MODEL, [text], config)
+                return response.text.strip()
+            except Exception as e:
+                if not cache_is_missing(e):
+                    raise
+                print(f"Cached prompt expired, sending full prompt: {e}")
+                self.prompt_cache.invalidate()
+        config = types.GenerateContentConfig(
+            system_instruction=STATIC_SYSTEM_INSTRUCTION + OUTBOUND_INSTRUCTION + BRIEFS[self.kind],
+            temperature=0.7,
+            max_output_tokens=300,
+        )
+        response = await generate_content(GEMINI_MODEL, [text], config)
+        return response.text.strip()
+
+    async def run(self):
+        generate_queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        send_queue = asyncio.Queue(maxsize=self.send_workers * 2)
+        executor = ThreadPoolExecutor(max_workers=self.send_workers, thread_name_prefix="campaign-send")
+        started = time.perf_counter()
+
+        async def produce():
+            for target in self.targets:
+                self.counts["selected"] += 1
+                if target["key"] in self.checkpoint:
+                    self.counts["skipped"] += 1
+                    continue
+                await generate_queue.put(target)
+            for _ in range(self.concurrency):
+                await generate_queue.put(None)
+
+        async def generate_worker():
+            while (target := await generate_queue.get()) is not None:
+                if not self.content_sid and not await self.in_session(target):
+                    self.counts["outside_window"] += 1
+                    if self.enforce_window:
+                        self.checkpoint.record(target["key"], "outside_window", to=target["to"])
+                        continue
+                begin = time.perf_counter()
+                try:
+                    with metrics.span("campaign_generate"):
+                        body = await self.generate(target)
+                except Exception as e:
+                    self.counts["generate_failed"] += 1
+                    self.checkpoint.record(target["key"], "failed", to=target["to"], error=f"generate: {e}")
+                    continue
+                self.generate_times.append(time.perf_counter() - begin)
+                self.counts["generated"] += 1
+                await send_queue.put((target, body))
+
+        async def send_worker():
+            loop = asyncio.get_running_loop()
+            while (item := await send_queue.get()) is not None:
+                target, body = item
+                while not self.send_bucket.try_take():
+                    await asyncio.sleep(1 / self.send_bucket.rate)
+                begin = time.perf_counter()
+                try:
+                    with metrics.span("campaign_send"):
+                        if self.content_sid:
+                            variables = self.template_variables(target, body)
+                            send = partial(self.sender.send, target["to"], body, content_sid=self.content_sid,
+                                           content_variables=variables)
+                        else:
+                            send = partial(self.sender.send, target["to"], body)
+                        sid = await loop.run_in_executor(executor, send)
+                except Exception as e:
+                    self.counts["send_failed"] += 1
+                    self.checkpoint.record(target["key"], "failed", to=target["to"], error=f"send: {e}")
+                    continue
+                self.send_times.append(time.perf_counter() - begin)
+                self.counts["sent"] += 1
+                self.checkpoint.record(target["key"], "sent", to=target["to"], sid=sid)
+
+        senders = [asyncio.create_task(send_worker()) for _ in range(self.send_workers)]
+        try:
+            await asyncio.gather(produce(), *(generate_worker() for _ in range(self.concurrency)))
+            for _ in senders:
+                await send_queue.put(None)
+            await asyncio.gather(*senders)
+        finally:
+            for task in senders:
+                task.cancel()
+            executor.shutdown(wait=False)
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed):
+        return dict(
+            self.counts,
+            elapsed_s=round(elapsed, 2),
+            sent_per_s=round(self.counts["sent"] / elapsed, 1) if elapsed else 0.0,
+            generate_p50_ms=percentile_ms(self.generate_times, 0.5),
+            generate_p95_ms=percentile_ms(self.generate_times, 0.95),
+            send_p50_ms=percentile_ms(self.send_times, 0.5),
+            send_p95_ms=percentile_ms(self.send_times, 0.95),
+            prompt_tokens=metrics.get("gemini_tokens_total", kind="prompt"),
+            cached_tokens=metrics.get("gemini_tokens_total", kind="cached"),
+            output_tokens=metrics.get("gemini_tokens_total", kind="output"),
+        )
+
+
+def percentile_ms(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("kind", choices=[RECEIPTS, CAMPAIGN, THANKS])
+    parser.add_argument("--campaign", choices=CURRENT_CAMPAIGNS, help="required for the campaign kind")
+    parser.add_argument("--content-sid", default=os.getenv("CAMPAIGN_CONTENT_SID"),
+                        help="approved WhatsApp template to send as, for donors outside the 24-hour window")
+    parser.add_argument("--checkpoint", help="JSONL progress file (default: campaign-<kind>.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=32, help="messages generated at once")
+    parser.add_argument("--send-rate", type=float, default=20, help="messages sent per second")
+    parser.add_argument("--send-workers", type=int, default=8)
+    parser.add_argument("--limit", type=int, help="stop after selecting this many messages")
+    parser.add_argument("--synthetic", type=int, default=0, help="add this many generated donors (trial runs)")
+    parser.add_argument("--dry-run", action="store_true", help="print messages instead of sending them")
+    parser.add_argument("--fake-twilio", action="store_true", help="send to an in-process fake_twilio.py stub")
+    parser.add_argument("--twilio-latency", type=float, default=0.05, help="stub latency, with --fake-twilio")
+    args = parser.parse_args()
+
+    if args.kind == CAMPAIGN and not args.campaign:
+        parser.error("--campaign is required for the campaign kind")
+
+    if args.synthetic:
+        repository = synthetic_repository(args.synthetic)
+    else:
+        repository = DonorRepository.from_tables(DUMMY_DONATIONS, DONOR_PHONE_NUMBERS, DONOR_EMAILS)
+
+    targets = select_targets(repository, args.kind, args.campaign)
+    if args.limit:
+        targets = (target for _, target in zip(range(args.limit), targets))
+
+    stub = None
+    if args.dry_run:
+        sender = PrintSender()
+    else:
+        base_url = os.getenv("TWILIO_API_BASE_URL") or "https://api.twilio.com"
+        if args.fake_twilio:
+            from fake_twilio import FakeTwilioServer
+            stub = FakeTwilioServer(latency=args.twilio_latency).start()
+            base_url = stub.url
+        sender = TwilioRestSender(
+            os.getenv("TWILIO_ACCOUNT_SID", "ACstub" if stub else ""),
+            os.getenv("TWILIO_AUTH_TOKEN", "stub" if stub else ""),
+            os.getenv("TWILIO_WHATSAPP_NUMBER", "whatsapp:+14155238886"),
+            base_url=base_url,
+        )
+        if not sender.account_sid or not sender.auth_token:
+            parser.error("set TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN, or use --fake-twilio / --dry-run")
+
+    checkpoint = Checkpoint(args.checkpoint or f"campaign-{args.kind}.jsonl")
+    runner = CampaignRunner(args.kind, targets, checkpoint, sender, concurrency=args.concurrency,
+                            send_rate=args.send_rate, send_workers=args.send_workers, content_sid=args.content_sid,
+                            history=storage, enforce_window=not (args.dry_run or stub))
+    try:
+        report = asyncio.run(runner.run())
+    finally:
+        checkpoint.close()
+        if stub:
+            stub.stop()
+
+    width = max(len(name) for name in report)
+    for name, value in report.items():
+        print(f"{name:<{width}}  {value}")
+    if report["outside_window"] and not args.content_sid:
+        action = "would be rejected by WhatsApp" if not runner.enforce_window else "were skipped"
+        print(f"{report['outside_window']} donors outside the 24-hour session window {action}; "
+              "use --content-sid to send them an approved template")
+    return 0 if not (report["generate_failed"] or report["send_failed"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
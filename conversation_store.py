@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict, deque
+
+
+class ConversationStore:
+    """
+    Bounded in-memory conversation history.
+
+    Each phone number keeps a ring buffer of its last max_turns exchanges
+    (one user message plus one assistant reply per turn). Conversations idle
+    for longer than idle_ttl seconds are dropped, and once more than
+    max_entries numbers are stored the least recently used one is evicted.
+
+    Messages carry the time of their turn in "at". A number can also hold a
+    rolling summary of older turns, which expires with its conversation.
+    """
+
+    def __init__(self, max_turns=5, idle_ttl=24 * 3600, max_entries=10000):
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+
+        # phone number -> (last access time, deque of messages, summary), oldest access first
+        self._entries = OrderedDict()
+
+        # Counters for monitoring
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, phone_number):
+        """Return the stored messages for a number, oldest first."""
+        now = time.time()
+        self._purge_expired(now)
+
+        entry = self._entries.get(phone_number)
+        if entry is None:
+            self.misses += 1
+            return []
+
+        self.hits += 1
+        _, messages, summary = entry
+        self._entries[phone_number] = (now, messages, summary)
+        self._entries.move_to_end(phone_number)
+        return list(messages)
+
+    def append(self, phone_number, user_message, assistant_message):
+        """Record one exchange, dropping the oldest turn once the buffer is full."""
+        now = time.time()
+        entry = self._entries.get(phone_number)
+        if entry is None:
+            messages, summary = deque(maxlen=self.max_turns * 2), None
+        else:
+            _, messages, summary = entry
+
+        messages.append({"role": "user", "content": user_message, "at": now})
+        messages.append({"role": "assistant", "content": assistant_message, "at": now})
+        self._entries[phone_number] = (now, messages, summary)
+        self._entries.move_to_end(phone_number)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_summary(self, phone_number):
+        """Return (summary, through) for a number, or None."""
+        entry = self._entries.get(phone_number)
+        return entry[2] if entry is not None else None
+
+    def set_summary(self, phone_number, summary, through):
+        """Store a summary covering every turn up to the time "through"."""
+        entry = self._entries.get(phone_number)
+        if entry is not None:
+            self._entries[phone_number] = (entry[0], entry[1], (summary, through))
+
+    def clear(self, phone_number):
+        self._entries.pop(phone_number, None)
+
+    def _purge_expired(self, now):
+        # Entries are kept in access order, so expired ones are at the front
+        while self._entries:
+            phone_number, (last_access, _, _) = next(iter(self._entries.items()))
+            if now - last_access < self.idle_ttl:
+                break
+            del self._entries[phone_number]
+            self.expirations += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "conversations": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
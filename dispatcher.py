@@ -0,0 +1,117 @@
+import asyncio
+from collections import deque
+
+
+class MessageDispatcher:
+    """
+    Processes the messages arriving on one WebSocket connection concurrently
+    across phone numbers while keeping strict arrival order per number.
+
+    Each ordering key gets its own lane (a deque drained by one task), so a
+    slow conversation only delays later messages from the same donor. At most
+    max_concurrent messages are processed at once, and submit() refuses new
+    work once max_queued messages are waiting or running.
+
+    cancel(request_id) drops a queued message or cancels it mid-processing
+    without replying; process() can also return None to send no reply.
+    on_done(data), if given, is called exactly once for every accepted
+    message, however it ends.
+    """
+
+    def __init__(self, process, reply, max_concurrent=64, max_queued=1000, on_done=None):
+        self.process = process
+        self.reply = reply
+        self.on_done = on_done
+        self.max_queued = max_queued
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.lanes = {}
+        self.queued = 0
+        self.tasks = set()
+        self.waiting = set()
+        self.running = {}
+        self.cancelled = set()
+
+    def submit(self, key, request_id, data):
+        """Queue a message on its lane. Returns False if the queue is full."""
+        if self.queued >= self.max_queued:
+            return False
+
+        self.queued += 1
+        if request_id is not None:
+            self.waiting.add(request_id)
+        lane = self.lanes.get(key)
+        if lane is not None:
+            lane.append((request_id, data))
+            return True
+
+        lane = self.lanes[key] = deque([(request_id, data)])
+        task = asyncio.create_task(self._drain(key, lane))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    def cancel(self, request_id):
+        """Abandon a message whose sender has stopped waiting for the reply."""
+        if request_id is None:
+            return
+        task = self.running.get(request_id)
+        if task is not None:
+            task.cancel()
+        elif request_id in self.waiting:
+            self.cancelled.add(request_id)
+
+    async def _drain(self, key, lane):
+        try:
+            while lane:
+                request_id, data = lane.popleft()
+                self.waiting.discard(request_id)
+                try:
+                    if request_id in self.cancelled:
+                        self.cancelled.discard(request_id)
+                        continue
+                    async with self.semaphore:
+                        task = asyncio.ensure_future(self.process(data))
+                        if request_id is not None:
+                            self.running[request_id] = task
+                        try:
+                            await asyncio.wait([task])
+                        finally:
+                            self.running.pop(request_id, None)
+                            if not task.done():
+                                # The lane itself is being cancelled
+                                task.cancel()
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        print(f"Error processing message: {task.exception()}")
+                        continue
+                    response = task.result()
+                    if response is None:
+                        continue
+                finally:
+                    self.queued -= 1
+                    self._done(data)
+                try:
+                    await self.reply(response, request_id)
+                except Exception as e:
+                    print(f"Error sending reply: {e}")
+        finally:
+            # Messages left behind when the connection goes away
+            while lane:
+                request_id, data = lane.popleft()
+                self.waiting.discard(request_id)
+                self.cancelled.discard(request_id)
+                self.queued -= 1
+                self._done(data)
+            del self.lanes[key]
+
+    def _done(self, data):
+        if self.on_done is not None:
+            self.on_done(data)
+
+    async def close(self):
+        """Cancel outstanding work, e.g. when the connection has gone away."""
+        for task in list(self.tasks):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
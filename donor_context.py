@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+NEW_DONOR_CONTEXT = "\nThis appears to be a new donor with no previous donation history in our system.\n"
+
+
+def estimate_tokens(text):
+    """Rough token count, about 4 characters per token."""
+    return len(text) // 4 + 1
+
+
+def render_donation(d):
+    receipt_status = "Sent on " + (datetime.strptime(d.get('date'), "%Y-%m-%d") + timedelta(days=2)).strftime("%Y-%m-%d") if d.get("receipt_sent") else "Pending - Will be sent within 24 hours"
+    return f"- ₹{d.get('amount')} on {d.get('date')} for {d.get('campaign')}, via {d.get('payment_method')}, UTR: {d.get('utr')}, Receipt Status: {receipt_status}\n"
+
+
+class DonorContextRenderer:
+    """
+    Renders the "Donor Information" block of the prompt and memoizes it per
+    donor. Entries are keyed on the donor's record version, so any change
+    made through the repository (new donation, receipt sent) re-renders it.
+
+    Histories that don't fit max_tokens keep the donations with pending
+    receipts and the most recent ones, in their original order, and sum up
+    the rest in one line.
+    """
+
+    def __init__(self, repository, max_tokens=600, max_entries=10000):
+        self.repository = repository
+        self.max_tokens = max_tokens
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, donor_id):
+        donor = self.repository.get(donor_id)
+        if not donor or not donor["donations"]:
+            return NEW_DONOR_CONTEXT
+
+        entry = self._cache.get(donor_id)
+        if entry is not None and entry[0] == donor["version"]:
+            self.hits += 1
+            self._cache.move_to_end(donor_id)
+            return entry[1]
+
+        self.misses += 1
+        text = self._render(donor)
+        self._cache[donor_id] = (donor["version"], text)
+        self._cache.move_to_end(donor_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return text
+
+    def _render(self, donor):
+        donations = donor["donations"]
+        header = f"\nDonor Information:\nName: {donations[0].get('donor_name')}\nPhone: {donor['phone']}\nEmail: {donor['email']}\n\nDonation History:\n"
+        rows = [render_donation(d) for d in donations]
+
+        budget = self.max_tokens - estimate_tokens(header)
+        if sum(estimate_tokens(row) for row in rows) <= budget:
+            return header + "".join(rows)
+
+        # Reserve room for the summary line, then keep pending receipts
+        # first and newer donations next
+        budget -= 40
+        newest_first = sorted(range(len(donations)), key=lambda i: donations[i].get("date") or "", reverse=True)
+        pending = [i for i in newest_first if not donations[i].get("receipt_sent")]
+        sent = [i for i in newest_first if donations[i].get("receipt_sent")]
+
+        kept = set()
+        for i in pending + sent:
+            cost = estimate_tokens(rows[i])
+            if cost > budget:
+                break
+            kept.add(i)
+            budget -= cost
+
+        omitted = [donations[i] for i in range(len(donations)) if i not in kept]
+        total = sum(d.get("amount") or 0 for d in omitted)
+        dates = sorted(d.get("date") for d in omitted if d.get("date"))
+        summary = f"- Plus {len(omitted)} earlier donations totalling ₹{total}"
+        if dates:
+            summary += f" between {dates[0]} and {dates[-1]}"
+        summary += ", all receipts sent\n" if all(d.get("receipt_sent") for d in omitted) else "\n"
+        return header + "".join(rows[i] for i in sorted(kept)) + summary
+
+    def stats(self):
+        return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,185 @@
+import os
+import re
+
+_NON_DIGITS = re.compile(r'\D')
+
+# Country code assumed for numbers written without one
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "91")
+
+
+def normalize_phone(phone_number):
+    """
+    Reduce a phone number to its E.164 digits, so "whatsapp:+91 98765 43210",
+    "+919876543210" and "9876543210" all map to "919876543210". Only a bare
+    10-digit number gets DEFAULT_COUNTRY_CODE; "+44 7654 321098" keeps its
+    own code and never matches an Indian number with the same last digits.
+    """
+    if not phone_number:
+        return None
+    digits = _NON_DIGITS.sub('', phone_number)
+    if len(digits) == 10:
+        return DEFAULT_COUNTRY_CODE + digits
+    if len(digits) < 10:
+        return None
+    return digits
+
+
+def normalize_utr(utr):
+    return utr.strip().upper() if utr else None
+
+
+class DonorRepository:
+    """
+    Donor records with hash indexes on normalised phone number, UTR and
+    donor name tokens, so every lookup is a dictionary hit instead of a scan
+    over all donors and donations.
+
+    Each donor is stored as {"phone", "email", "donations", "version"}. The
+    indexes are built once from the donor tables and kept up to date by
+    upsert_donor()/add_donation()/update_donation()/remove_donor(), which
+    only touch the keys of the donor being changed. "version" is bumped on
+    every change, so caches derived from a donor can key on it.
+    """
+
+    def __init__(self):
+        self.donors = {}
+        self._by_phone = {}
+        self._by_utr = {}
+        self._by_name = {}
+
+    @classmethod
+    def from_tables(cls, donations, phone_numbers, emails=None):
+        """Build a repository from the id-keyed donation/phone/email dictionaries."""
+        repository = cls()
+        emails = emails or {}
+        for donor_id in dict.fromkeys(list(donations) + list(phone_numbers)):
+            repository.upsert_donor(
+                donor_id,
+                phone=phone_numbers.get(donor_id),
+                email=emails.get(donor_id),
+                donations=donations.get(donor_id, [])
+            )
+        return repository
+
+    # Lookups
+
+    def get(self, donor_id):
+        return self.donors.get(donor_id)
+
+    def find_by_phone(self, phone_number):
+        key = normalize_phone(phone_number)
+        return self._by_phone.get(key) if key else None
+
+    def find_by_utr(self, utr):
+        return self._by_utr.get(normalize_utr(utr))
+
+    def find_by_name(self, name):
+        """Match a first name, surname or full name, case-insensitively."""
+        if not name:
+            return None
+        donor_ids = self._by_name.get(name.strip().lower())
+        return next(iter(donor_ids)) if donor_ids else None
+
+    def find_donation(self, utr):
+        """Return (donor_id, donation) for a UTR, or (None, None)."""
+        donor_id = self.find_by_utr(utr)
+        if donor_id is None:
+            return None, None
+        key = normalize_utr(utr)
+        for donation in self.donors[donor_id]["donations"]:
+            if normalize_utr(donation.get("utr")) == key:
+                return donor_id, donation
+        return None, None
+
+    # Incremental updates
+
+    def upsert_donor(self, donor_id, phone=None, email=None, donations=None):
+        """Add or replace a donor and re-index only that donor."""
+        previous = self.donors.get(donor_id)
+        version = 0
+        if previous is not None:
+            self._unindex(donor_id, previous)
+            version = previous["version"] + 1
+
+        donor = {
+            "phone": phone,
+            "email": email,
+            "donations": list(donations or []),
+            "version": version,
+        }
+        self.donors[donor_id] = donor
+        self._index(donor_id, donor)
+        return donor
+
+    def add_donation(self, donor_id, donation):
+        donor = self.donors.get(donor_id)
+        if donor is None:
+            donor = self.upsert_donor(donor_id)
+        donor["donations"].append(donation)
+        donor["version"] += 1
+        self._index_donation(donor_id, donation)
+
+    def update_donation(self, utr, **changes):
+        """
+        Change fields of the donation with this UTR, e.g.
+        update_donation("UTR789456", receipt_sent=True). Returns the updated
+        donation, or None if the UTR is unknown.
+        """
+        donor_id, donation = self.find_donation(utr)
+        if donation is None:
+            return None
+        donor = self.donors[donor_id]
+        self._unindex(donor_id, donor)
+        donation.update(changes)
+        donor["version"] += 1
+        self._index(donor_id, donor)
+        return donation
+
+    def mark_receipt_sent(self, utr):
+        return self.update_donation(utr, receipt_sent=True)
+
+    def remove_donor(self, donor_id):
+        donor = self.donors.pop(donor_id, None)
+        if donor is not None:
+            self._unindex(donor_id, donor)
+
+    def _index(self, donor_id, donor):
+        key = normalize_phone(donor["phone"])
+        if key:
+            self._by_phone.setdefault(key, donor_id)
+        for donation in donor["donations"]:
+            self._index_donation(donor_id, donation)
+
+    def _index_donation(self, donor_id, donation):
+        utr = normalize_utr(donation.get("utr"))
+        if utr:
+            self._by_utr.setdefault(utr, donor_id)
+        for key in _name_keys(donation.get("donor_name")):
+            # Insertion-ordered dict used as an ordered set of donor ids
+            self._by_name.setdefault(key, {})[donor_id] = None
+
+    def _unindex(self, donor_id, donor):
+        key = normalize_phone(donor["phone"])
+        if key and self._by_phone.get(key) == donor_id:
+            del self._by_phone[key]
+        for donation in donor["donations"]:
+            utr = normalize_utr(donation.get("utr"))
+            if utr and self._by_utr.get(utr) == donor_id:
+                del self._by_utr[utr]
+            for key in _name_keys(donation.get("donor_name")):
+                donor_ids = self._by_name.get(key)
+                if donor_ids and donor_id in donor_ids:
+                    del donor_ids[donor_id]
+                    if not donor_ids:
+                        del self._by_name[key]
+
+    def __len__(self):
+        return len(self.donors)
+
+
+def _name_keys(donor_name):
+    if not donor_name:
+        return []
+    name = donor_name.strip().lower()
+    parts = name.split()
+    return [name] + parts if len(parts) > 1 else parts
@@ -0,0 +1,197 @@
+"""
+Offline stand-in for google.genai.Client.
+
+Implements the small part of the async client the bot uses (models.generate_content
+and caches.create/update/get/delete) with configurable latency, so the bot can be
+exercised and benchmarked without spending Gemini quota. Enable it in the bot with
+USE_FAKE_GEMINI=1.
+"""
+import time
+import random
+import asyncio
+import itertools
+from datetime import datetime, timezone
+from google.genai import types
+
+
+# Smallest prompt Gemini will store as cached content (gemini-2.0-flash)
+MIN_CACHE_TOKENS = 4096
+
+
+class FakeAPIError(Exception):
+    """Raised where the real API would return an error status."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def estimate_tokens(value):
+    """Rough token count (about 4 characters per token) for any contents shape."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return max(1, len(value) // 4)
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_tokens(v) for v in value)
+    if isinstance(value, types.Content):
+        return sum(estimate_tokens(p.text) for p in value.parts or [])
+    if isinstance(value, types.Part):
+        return estimate_tokens(value.text)
+    return estimate_tokens(str(value))
+
+
+def _last_user_text(contents):
+    if isinstance(contents, str):
+        return contents
+    for item in reversed(list(contents or [])):
+        if isinstance(item, str):
+            return item
+        if isinstance(item, types.Content) and item.role != "model" and item.parts:
+            return item.parts[-1].text or ""
+    return ""
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class _FakeModels:
+    def __init__(self, fake):
+        self._fake = fake
+
+    async def generate_content(self, model, contents, config=None):
+        fake = self._fake
+        fake.stats["generate_calls"] += 1
+        await asyncio.sleep(fake.next_latency())
+
+        if fake.failure_rate and random.random() < fake.failure_rate:
+            fake.stats["errors"] += 1
+            raise FakeAPIError(503, "The model is overloaded. Please try again later.")
+
+        prompt_tokens = estimate_tokens(contents)
+        cached_tokens = 0
+        cached_name = getattr(config, "cached_content", None) if config else None
+        if cached_name:
+            cached = fake.get_live_cache(cached_name)
+            if cached is None:
+                fake.stats["cache_misses"] += 1
+                raise FakeAPIError(404, f"CachedContent not found (or permission denied): {cached_name}")
+            fake.stats["cache_hits"] += 1
+            cached_tokens = cached["tokens"]
+        elif config is not None and config.system_instruction:
+            prompt_tokens += estimate_tokens(config.system_instruction)
+
+        text = fake.reply_fn(_last_user_text(contents)) if fake.reply_fn else fake.reply_text
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens + cached_tokens,
+            cached_content_token_count=cached_tokens or None,
+            candidates_token_count=estimate_tokens(text),
+            total_token_count=prompt_tokens + cached_tokens + estimate_tokens(text),
+        )
+        return FakeResponse(text, usage)
+
+
+class _FakeCaches:
+    def __init__(self, fake):
+        self._fake = fake
+
+    def _to_cached_content(self, name):
+        entry = self._fake.caches[name]
+        return types.CachedContent(
+            name=name,
+            model=entry["model"],
+            display_name=entry["display_name"],
+            expire_time=datetime.fromtimestamp(entry["expires_at"], tz=timezone.utc),
+        )
+
+    async def create(self, model, config=None):
+        fake = self._fake
+        await asyncio.sleep(fake.next_latency())
+        tokens = estimate_tokens(config.system_instruction) + estimate_tokens(config.contents)
+        if tokens < fake.min_cache_tokens:
+            raise FakeAPIError(400, f"Cached content is too small. total_token_count={tokens}, min_total_token_count={fake.min_cache_tokens}")
+        name = f"cachedContents/fake-{next(fake._ids)}"
+        fake.caches[name] = {
+            "model": model,
+            "display_name": config.display_name,
+            "tokens": tokens,
+            "expires_at": time.time() + _ttl_seconds(config.ttl),
+        }
+        fake.stats["caches_created"] += 1
+        return self._to_cached_content(name)
+
+    async def update(self, name, config=None):
+        fake = self._fake
+        if fake.get_live_cache(name) is None:
+            raise FakeAPIError(404, f"CachedContent not found: {name}")
+        fake.caches[name]["expires_at"] = time.time() + _ttl_seconds(config.ttl)
+        fake.stats["caches_refreshed"] += 1
+        return self._to_cached_content(name)
+
+    async def get(self, name, config=None):
+        if self._fake.get_live_cache(name) is None:
+            raise FakeAPIError(404, f"CachedContent not found: {name}")
+        return self._to_cached_content(name)
+
+    async def delete(self, name, config=None):
+        self._fake.caches.pop(name, None)
+
+
+class _FakeAio:
+    def __init__(self, fake):
+        self.models = _FakeModels(fake)
+        self.caches = _FakeCaches(fake)
+
+
+def _ttl_seconds(ttl):
+    if not ttl:
+        return 3600
+    return float(str(ttl).rstrip("s"))
+
+
+class FakeClient:
+    """
+    Fake Gemini client with configurable latency and failure rate.
+
+    latency/jitter are in seconds; every call sleeps latency plus a uniform
+    random jitter. reply_fn, if given, receives the last user message and
+    returns the reply text.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, reply_text=None, reply_fn=None,
+                 failure_rate=0.0, min_cache_tokens=MIN_CACHE_TOKENS):
+        self.latency = latency
+        self.jitter = jitter
+        self.reply_text = reply_text or "Namaste! Thank you for reaching out to Narayan Shiva Sansthan. How may I help you today?"
+        self.reply_fn = reply_fn
+        self.failure_rate = failure_rate
+        self.min_cache_tokens = min_cache_tokens
+        self.caches = {}
+        self.stats = {
+            "generate_calls": 0,
+            "errors": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "caches_created": 0,
+            "caches_refreshed": 0,
+        }
+        self._ids = itertools.count(1)
+        self.aio = _FakeAio(self)
+
+    def next_latency(self):
+        if self.jitter:
+            return self.latency + random.uniform(0, self.jitter)
+        return self.latency
+
+    def get_live_cache(self, name):
+        entry = self.caches.get(name)
+        if entry is None or entry["expires_at"] <= time.time():
+            return None
+        return entry
+
+    def expire_cache(self, name):
+        """Simulate the server dropping a cache before its TTL ran out."""
+        self.caches.pop(name, None)
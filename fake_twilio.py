@@ -0,0 +1,139 @@
+"""
+Local stand-in for the Twilio Messages REST API.
+
+Accepts POST /2010-04-01/Accounts/<sid>/Messages.json like Twilio does and
+records every message, with configurable latency and failure rate, so the
+connector's async reply mode can be run and benchmarked offline. Point the
+connector at it with TWILIO_API_BASE_URL=http://127.0.0.1:8790.
+
+    python fake_twilio.py --port 8790 --latency 0.05
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import itertools
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/([^/]+)/Messages\.json$')
+
+
+class FakeTwilioServer:
+    """
+    Threaded HTTP server recording sent messages in .messages.
+    Use port=0 to pick a free port; the bound address is in .url.
+    on_message(message), if given, is called for every accepted message.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, on_message=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.on_message = on_message
+        self.messages = []
+        self.stats = {"accepted": 0, "rejected": 0}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    # A client dropped its keep-alive connection
+                    pass
+
+            def do_POST(self):
+                match = MESSAGES_PATH.match(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                if not match:
+                    return self._reply(404, {"code": 20404, "message": "The requested resource was not found"})
+
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.failure_rate and random.random() < fake.failure_rate:
+                    with fake._lock:
+                        fake.stats["rejected"] += 1
+                    return self._reply(503, {"code": 20503, "message": "Service unavailable"})
+                if not form.get("To") or not (form.get("Body") or form.get("ContentSid")):
+                    return self._reply(400, {"code": 21604, "message": "A 'To' and 'Body' are required"})
+                if form.get("From", "").startswith("whatsapp:") != form["To"].startswith("whatsapp:"):
+                    return self._reply(400, {"code": 21910, "message": "Invalid From and To pair"})
+
+                message = {
+                    "sid": f"SM{next(fake._ids):032x}",
+                    "account_sid": match.group(1),
+                    "to": form.get("To"),
+                    "from": form.get("From"),
+                    "body": form.get("Body"),
+                    "content_sid": form.get("ContentSid"),
+                    "content_variables": form.get("ContentVariables"),
+                    "status": "queued",
+                    "received_at": time.time(),
+                }
+                with fake._lock:
+                    fake.messages.append(message)
+                    fake.stats["accepted"] += 1
+                if fake.on_message:
+                    fake.on_message(message)
+                self._reply(201, message)
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-twilio", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeTwilioServer(args.host, args.port, args.latency, args.failure_rate)
+    print(f"Fake Twilio API listening on {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Accepted {server.stats['accepted']} messages, rejected {server.stats['rejected']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import re
+from datetime import datetime, timedelta
+from intent_engine import INTENT_RULES
+
+# Donor matches we trust enough to answer from the record without the LLM
+TRUSTED_MATCHES = ("phone", "utr")
+
+# Evidence behind each intent, matched as whole words in the lowercased
+# message. The intent classifier only looks for substrings, so on its own
+# "address" in "your email address" would get the office template.
+OFFICE_ABOUT_US = re.compile(
+    r"\b(?:where are you|where is your|how (?:do i|can i|to) (?:reach|get to|find) you"
+    r"|your (?:nearest |main |head )?(?:office|center|centre|address|location)"
+    r"|you(?:'re| are) located|visit (?:you|your office))\b"
+)
+OFFICE_STRONG = re.compile(r"\b(?:office|offices|directions)\b")
+# Words that often have nothing to do with our office
+OFFICE_AMBIGUOUS = re.compile(r"\b(?:address|location|visit|come to)\b")
+
+UTR_STATUS_QUESTION = re.compile(
+    r"\b(?:received?|receiving|went through|go through|confirm\w*|successful|status|credited|reached|get it)\b"
+)
+RECEIPT_STRONG = re.compile(r"\b(?:receipts?|80g|certificates?|acknowledge?ments?)\b")
+
+# Requests a template would answer wrongly even when the intent is right
+CONFUSERS = {
+    "office_inquiry": re.compile(
+        r"\b(?:e-?mail|website|site|online|link|drop(?:\s|-)?off|clothes|items|courier|post|refund\w*)\b"
+    ),
+    "utr_verification": re.compile(
+        r"\b(?:refund\w*|cancel\w*|twice|double|wrong|deducted|failed|revers\w*|dispute|chargeback|change|update)\b"
+    ),
+    "receipt_issue": re.compile(
+        r"\b(?:wrong|incorrect|correct\w*|change|update|pan|name on|address on|duplicate|cancel\w*|refund\w*)\b"
+    ),
+}
+
+
+def _competing_intents():
+    """
+    For each intent, whole-word patterns for every other intent's keyword
+    groups, leaving out keywords the two share ("80g" is both a receipt and
+    a tax-benefit word, so it is no sign of a second topic).
+    """
+    keywords = {intent: {k for group in groups for k in group} for intent, groups in INTENT_RULES}
+    competing = {}
+    for intent, _ in INTENT_RULES:
+        competing[intent] = []
+        for other, groups in INTENT_RULES:
+            if other == intent:
+                continue
+            own = [[k for k in group if k not in keywords[intent]] for group in groups]
+            if all(own):
+                competing[intent].append([
+                    re.compile(r"\b(?:" + "|".join(re.escape(k) for k in group) + r")\b") for group in own
+                ])
+    return competing
+
+
+COMPETING_INTENTS = _competing_intents()
+
+
+def _first_name(donation):
+    name = (donation.get("donor_name") or "").split()
+    return name[0] if name else ""
+
+
+def _receipt_sent_on(donation):
+    return (datetime.strptime(donation.get("date"), "%Y-%m-%d") + timedelta(days=2)).strftime("%Y-%m-%d")
+
+
+class FastPathResponder:
+    """
+    Templated replies for intents whose answer is fully determined by data we
+    already hold: office details, UTR confirmations and receipt status.
+
+    respond() returns (reply, confidence) or None. Callers should only use
+    the reply when confidence clears their threshold, and fall through to
+    the LLM otherwise. Confidence comes from the message itself: whether
+    the keyword that decided the intent is a whole word and unambiguous,
+    whether the message is a question about us or the donation, and
+    whether another intent or a request the template can't answer is
+    mentioned too.
+    """
+
+    def __init__(self, donor_repository, office_address, office_hours, helpdesk, receipts_email):
+        self.donor_repository = donor_repository
+        self.office_address = office_address
+        self.office_hours = office_hours
+        self.helpdesk = helpdesk
+        self.receipts_email = receipts_email
+
+    def respond(self, intent, extracted_info, user_id, match_source, query):
+        text = query.lower()
+        if intent == "office_inquiry":
+            result = self._office(), self._office_confidence(text)
+        elif intent == "utr_verification":
+            result = self._utr(extracted_info, user_id, match_source, text)
+        elif intent == "receipt_issue":
+            if match_source not in TRUSTED_MATCHES:
+                return None
+            result = self._receipt(user_id, text)
+        else:
+            return None
+        if result is None:
+            return None
+
+        reply, confidence = result
+        return reply, confidence * self._context_penalty(intent, text) * self._message_penalty(query)
+
+    def _context_penalty(self, intent, text):
+        """Halve confidence for each sign that the message is about something else too."""
+        penalty = 1.0
+        if any(all(group.search(text) for group in groups) for groups in COMPETING_INTENTS.get(intent, ())):
+            penalty *= 0.5
+        confusers = CONFUSERS.get(intent)
+        if confusers is not None and confusers.search(text):
+            penalty *= 0.5
+        return penalty
+
+    def _office_confidence(self, text):
+        if OFFICE_ABOUT_US.search(text):
+            return 0.95
+        if OFFICE_STRONG.search(text):
+            return 0.85
+        if OFFICE_AMBIGUOUS.search(text):
+            # "address", "visit" or "location" alone: let the LLM read it
+            return 0.5
+        # The keyword only appeared inside another word ("relocation")
+        return 0.2
+
+    def _message_penalty(self, query):
+        """Lower confidence for messages a template is likely to under-answer."""
+        # Replies should match the donor's language; templates are English only
+        if any(ord(char) > 127 and char.isalpha() for char in query):
+            return 0.3
+        penalty = 1.0
+        if len(query.split()) > 25:
+            penalty *= 0.6
+        if query.count("?") > 1:
+            penalty *= 0.8
+        return penalty
+
+    def _office(self):
+        return (
+            f"Namaste! Our office is at {self.office_address}. "
+            f"We're open {self.office_hours}, and you're most welcome to visit us. "
+            "Is there anything else I can help you with?"
+        )
+
+    def _utr(self, extracted_info, user_id, match_source, text):
+        if not extracted_info.get("utr"):
+            return None
+        donor_id, donation = self.donor_repository.find_donation(extracted_info["utr"])
+        if donation is None:
+            return None
+
+        # The sender's number belongs to someone else; let the LLM handle it
+        if match_source == "phone" and donor_id != user_id:
+            return None
+
+        if donation.get("receipt_sent"):
+            receipt = f"Your receipt was sent on {_receipt_sent_on(donation)}."
+        else:
+            receipt = "Your receipt will be sent within 24 hours."
+        reply = (
+            f"Namaste {_first_name(donation)} ji! Yes, we have received your donation of "
+            f"₹{donation.get('amount')} on {donation.get('date')} for {donation.get('campaign')} "
+            f"via {donation.get('payment_method')} (UTR: {donation.get('utr')}). {receipt} "
+            "Thank you so much for your generosity!"
+        )
+        # The UTR names the donation; asking whether it arrived is what the
+        # template answers. A different amount suggests a dispute.
+        confidence = 0.95 if UTR_STATUS_QUESTION.search(text) else 0.85
+        amount = extracted_info.get("amount")
+        if amount and str(amount) != str(donation.get("amount")):
+            confidence *= 0.5
+        return reply, confidence
+
+    def _receipt(self, user_id, text):
+        donor = self.donor_repository.get(user_id)
+        if not donor or not donor["donations"]:
+            return None
+
+        pending = [d for d in donor["donations"] if not d.get("receipt_sent")]
+        if pending:
+            d = pending[0]
+            reply = (
+                f"Namaste {_first_name(d)} ji, I'm sorry for the delay. The receipt for your "
+                f"₹{d.get('amount')} donation on {d.get('date')} for {d.get('campaign')} is being "
+                f"processed and will reach you within 24 hours. For anything urgent, please write to "
+                f"{self.receipts_email} or call our helpdesk at {self.helpdesk}."
+            )
+        else:
+            d = donor["donations"][0]
+            reply = (
+                f"Namaste {_first_name(d)} ji! Our records show the receipt for your ₹{d.get('amount')} "
+                f"donation on {d.get('date')} was sent on {_receipt_sent_on(d)} to {donor['email']}. "
+                "Please check your spam folder too. If you still can't find it, write to "
+                f"{self.receipts_email} and we'll resend it right away."
+            )
+        # "tax" alone may well be a tax-benefit question
+        return reply, 0.9 if RECEIPT_STRONG.search(text) else 0.6
@@ -0,0 +1,138 @@
+import asyncio
+import metrics
+from donor_context import estimate_tokens
+
+
+def _turns(history):
+    """Group messages into turns (the messages appended together share "at")."""
+    turns = []
+    for message in history:
+        if turns and turns[-1][0].get("at") == message.get("at") and message.get("role") != "user":
+            turns[-1].append(message)
+        else:
+            turns.append([message])
+    return turns
+
+
+def _turn_tokens(turn):
+    return sum(estimate_tokens(m.get("content", "")) for m in turn)
+
+
+def _truncate(turn, tokens):
+    """Shorten every message of a turn to about tokens / len(turn) tokens."""
+    limit = max(tokens // len(turn), 1) * 4
+    return [dict(m, content=m.get("content", "")[:limit] + "…") if len(m.get("content", "")) > limit else m
+            for m in turn]
+
+
+class HistoryManager:
+    """
+    Fits conversation history into a token budget.
+
+    Up to recent_turns of the most recent turns are kept verbatim, newest
+    first, as long as they fit. Older turns are folded into a rolling summary
+    by summarize() in a background task, so the reply never waits for it.
+
+    Folding runs in batches, so long conversations cost about one extra
+    Gemini call every fold_turns messages rather than one per message. Until
+    fold_turns older turns have built up they are sent verbatim too, budget
+    permitting, and whatever doesn't fit is left out meanwhile. A fold
+    starts early only if the store (max_turns turns per number) is about to
+    drop a turn the summary doesn't cover yet.
+
+    summarize(previous_summary, messages, max_tokens) is an async callable
+    returning the new summary text. Without it older turns are just dropped.
+    """
+
+    def __init__(self, storage, summarize=None, recent_turns=6, summary_tokens=300, fold_turns=4, max_turns=None):
+        self.storage = storage
+        self.recent_turns = recent_turns
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+        self.fold_turns = fold_turns
+        self.max_turns = max_turns
+        self._tasks = {}
+
+    async def select(self, phone_number, history, budget):
+        """
+        Return (summary, messages) to send for a conversation, using at most
+        budget tokens between them.
+        """
+        stored = await self.storage.get_summary(phone_number) if self.summarize else None
+        summary, through = stored or (None, 0)
+
+        all_turns = _turns(history)
+        turns = [turn for turn in all_turns if turn[0].get("at", 0) > through]
+        available = budget - (estimate_tokens(summary) if summary else 0)
+        recent = turns[-self.recent_turns:]
+        backlog = turns[:len(turns) - len(recent)]
+
+        kept = []
+        for turn in reversed(recent):
+            cost = _turn_tokens(turn)
+            if cost > available:
+                break
+            kept.append(turn)
+            available -= cost
+        kept.reverse()
+
+        if not kept and turns and available > 0:
+            # Even the latest turn is too long; send a shortened copy of it
+            kept = [_truncate(turns[-1], available)]
+            older = turns[:-1]
+        else:
+            older = turns[:len(turns) - len(kept)]
+            # Older turns not summarized yet go in too while they fit
+            extra = []
+            if len(kept) == len(recent):
+                for turn in reversed(backlog):
+                    cost = _turn_tokens(turn)
+                    if cost > available:
+                        break
+                    extra.append(turn)
+                    available -= cost
+                extra.reverse()
+            kept = extra + kept
+
+        if len(older) >= self.fold_turns or self._store_full(all_turns, older):
+            self._fold_later(phone_number, summary, older)
+
+        return summary, [message for turn in kept for message in turn]
+
+    def _store_full(self, all_turns, older):
+        """Whether the next turn stored will push out one the summary lacks."""
+        if self.max_turns is None or not older:
+            return False
+        return len(all_turns) >= self.max_turns and all_turns[0] is older[0]
+
+    def _fold_later(self, phone_number, summary, turns):
+        if self.summarize is None:
+            return
+        task = self._tasks.get(phone_number)
+        if task is not None and not task.done():
+            # A fold is already running; whatever it misses is picked up next time
+            return
+        task = asyncio.create_task(self._fold(phone_number, summary, turns))
+        self._tasks[phone_number] = task
+
+        def forget(done):
+            if self._tasks.get(phone_number) is done:
+                del self._tasks[phone_number]
+        task.add_done_callback(forget)
+
+    async def _fold(self, phone_number, summary, turns):
+        messages = [message for turn in turns for message in turn]
+        try:
+            with metrics.span("summarize"):
+                new_summary = await self.summarize(summary, messages, self.summary_tokens)
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
+            metrics.inc("history_summaries_total", outcome="error")
+            return
+        if new_summary:
+            await self.storage.set_summary(phone_number, new_summary.strip(), turns[-1][0].get("at", 0))
+            metrics.inc("history_summaries_total", outcome="ok")
+
+    async def close(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
@@ -0,0 +1,236 @@
+import re
+
+# Keyword table for intent detection. Intents are checked in order and the
+# first one whose keyword groups all match wins. A group matches when any of
+# its keywords appears anywhere in the message (case-insensitive substring).
+INTENT_RULES = [
+    ("donation_intent", [
+        ["donate", "contribution", "give", "support", "contribute", "payment"],
+    ]),
+    ("receipt_issue", [
+        ["receipt", "tax", "acknowledgment", "certificate", "80g"],
+        ["didn't get", "haven't received", "missing", "where", "not received"],
+    ]),
+    ("utr_verification", [
+        ["utr", "transaction", "payment", "confirm", "successful", "went through"],
+    ]),
+    ("volunteer_inquiry", [
+        ["volunteer", "volunteering", "help out", "join", "participate"],
+    ]),
+    ("tax_benefit_inquiry", [
+        ["tax benefit", "80g", "deduction", "tax exemption"],
+    ]),
+    ("project_inquiry", [
+        ["project", "campaign", "initiative", "program", "what do you do"],
+    ]),
+    ("office_inquiry", [
+        ["office", "location", "address", "visit", "come to"],
+    ]),
+]
+DEFAULT_INTENT = "general_inquiry"
+
+# Phrases that usually precede a name ("my name is ...") and names we
+# recognise anywhere in the text. Known names take priority.
+NAME_INDICATORS = ["name is", "this is", "called", "speaking", "named", "by the name"]
+COMMON_NAMES = ["Arvin", "Rajesh", "Priya", "Amit", "Sneha"]
+
+# Entity patterns for the lowercased message, as (entity, rank, possible
+# first characters, rest of the pattern). Each entity takes the first match
+# of its highest-ranked pattern, like the original sequence of re.search calls.
+ENTITY_PATTERNS = [
+    ("utr", 0, "u", r'tr\d+'),
+    ("phone", 0, "+", r'91\s?[789]\d{9}'),
+    ("phone", 0, "789", r'\d{9}'),
+    ("phone", 1, "+", r'91\s?[789]\d\d\d\d\s?\d\d\d\d\d'),
+    ("phone", 1, "789", r'\d\d\d\d\s?\d\d\d\d\d'),
+    ("amount", 0, "₹", r'\s*\d+'),
+    ("amount", 1, "r", r's\.?\s*\d+'),  # "Rs" is case-sensitive, checked on the original text
+    ("amount", 2, "0123456789", r'\d*\s*rupees'),
+]
+RUPEES_PATTERN = r'\d+\s*rupees'
+_DIGITS = re.compile(r'\d+')
+
+
+def _trie(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+    return trie
+
+
+def _render_trie(node):
+    """
+    Render a trie of literal words as a regex with shared prefixes factored
+    out. Greedy optional tails make longer words win at each position.
+    """
+    branches = [re.escape(char) + _render_trie(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return f"(?:{body})?" if "" in node else body
+
+
+def _offsets(query):
+    """Map each index of query.lower() to the index in query it came from."""
+    offsets = []
+    for i, char in enumerate(query):
+        offsets.extend([i] * len(char.lower()))
+    offsets.append(len(query))
+    return offsets
+
+
+class MessageAnalyzer:
+    """
+    Precompiled single-pass intent and entity extraction.
+
+    All keywords and entity patterns are compiled into one regex that is
+    tried at every position of the lowercased message (inside a lookahead,
+    so overlapping matches are seen). One scan yields the intent, UTR,
+    amount, phone number and name, with the same precedence rules as the
+    original if/elif chain and sequential re.search calls.
+    """
+
+    def __init__(self, intent_rules=INTENT_RULES, name_indicators=NAME_INDICATORS,
+                 common_names=COMMON_NAMES, default_intent=DEFAULT_INTENT):
+        self.default_intent = default_intent
+        self.name_indicators = [indicator.lower() for indicator in name_indicators]
+        self.common_names = list(common_names)
+
+        # Every keyword maps to the tags it proves present. Tags are
+        # (intent index, group index) for intents, ("indicator", i) and
+        # ("name", i) for names.
+        keyword_tags = {}
+        for i, (intent, groups) in enumerate(intent_rules):
+            for j, group in enumerate(groups):
+                for keyword in group:
+                    keyword_tags.setdefault(keyword.lower(), set()).add((i, j))
+        for i, indicator in enumerate(self.name_indicators):
+            keyword_tags.setdefault(indicator, set()).add(("indicator", i))
+        for i, name in enumerate(self.common_names):
+            keyword_tags.setdefault(name.lower(), set()).add(("name", i))
+
+        # The scan reports only the longest keyword at each position; any
+        # shorter keyword matching there is a prefix of it, so fold its tags in
+        self.keyword_tags = {
+            keyword: frozenset().union(*(tags for other, tags in keyword_tags.items() if keyword.startswith(other)))
+            for keyword in keyword_tags
+        }
+        self.intent_rules = [
+            (intent, frozenset((i, j) for j in range(len(groups))))
+            for i, (intent, groups) in enumerate(intent_rules)
+        ]
+        self.name_tags = frozenset(tag for tags in self.keyword_tags.values() for tag in tags if tag[0] in ("indicator", "name"))
+
+        # The scanner is one alternation whose branches each consume a single
+        # literal character and look ahead for the rest of a pattern. Starting
+        # every branch with a literal lets the regex engine jump straight to
+        # candidate positions, and consuming only one character keeps
+        # overlapping matches visible. Each branch ends in an empty named
+        # group, so match.lastgroup tells which pattern matched and
+        # match.end(lastgroup) where it ends.
+        self.markers = {}
+        alternatives = []
+        for n, (kind, rank, first_chars, rest) in enumerate(ENTITY_PATTERNS):
+            for m, char in enumerate(first_chars):
+                marker = f"e{n}_{m}"
+                self.markers[marker] = (kind, rank)
+                alternatives.append(f"{re.escape(char)}(?={rest}(?P<{marker}>))")
+        trie = _trie(self.keyword_tags)
+        for m, (char, child) in enumerate(sorted(trie.items())):
+            alternatives.append(f"{re.escape(char)}(?={_render_trie(child)}(?P<k{m}>))")
+        scanner = "|".join(alternatives)
+        keyword = _render_trie(trie)
+
+        self._scanner = re.compile(scanner)
+        self._keyword = re.compile(keyword)
+        self._rupees = re.compile(RUPEES_PATTERN)
+
+    def analyze(self, query):
+        """Return {"intent", "utr", "amount", "phone", "name"} for a message."""
+        # Keywords are matched in the lowercased text, like the original. For
+        # the rare text whose length changes when lowercased (e.g. "İ"),
+        # entity values are cut from the original through an offset map.
+        lower = query.lower()
+        offsets = _offsets(query) if len(lower) != len(query) else None
+
+        tags = set()
+        keyword_tags = self.keyword_tags
+        found = {"utr": [None], "phone": [None, None], "amount": [None, None, None]}
+
+        for match in self._scanner.finditer(lower):
+            marker = match.lastgroup
+            pos = match.start()
+            if marker[0] == "k":
+                tags |= keyword_tags[lower[pos:match.end(marker)]]
+                continue
+
+            # An entity won this position; a keyword (e.g. "utr" in "UTR123")
+            # or, after a phone number, the rupees pattern may also match here
+            word = self._keyword.match(lower, pos)
+            if word:
+                tags |= keyword_tags[word.group(0)]
+
+            kind, rank = self.markers[marker]
+            if kind == "phone" and found["amount"][2] is None:
+                rupees = self._rupees.match(lower, pos)
+                if rupees:
+                    found["amount"][2] = _DIGITS.match(rupees.group(0)).group(0)
+
+            slots = found[kind]
+            if slots[rank] is not None:
+                continue
+            start, end = pos, match.end(marker)
+            if offsets is not None:
+                start, end = offsets[start], offsets[end]
+            value = query[start:end]
+            if kind == "amount":
+                if rank == 1 and not value.startswith("Rs"):
+                    continue
+                value = _DIGITS.search(value).group(0)
+            slots[rank] = value
+
+        # Matched values are never empty strings, so "or" picks the best rank
+        amounts, phones = found["amount"], found["phone"]
+        return {
+            "intent": self._intent(tags),
+            "utr": found["utr"][0],
+            "amount": amounts[0] or amounts[1] or amounts[2],
+            "phone": phones[0] or phones[1],
+            "name": self._name(lower, tags),
+        }
+
+    def _intent(self, tags):
+        for intent, required in self.intent_rules:
+            if required <= tags:
+                return intent
+        return self.default_intent
+
+    def _name(self, lower, tags):
+        if tags.isdisjoint(self.name_tags):
+            return None
+
+        for i, name in enumerate(self.common_names):
+            if ("name", i) in tags:
+                return name
+
+        for i, indicator in enumerate(self.name_indicators):
+            if ("indicator", i) not in tags:
+                continue
+            # The first word after the first occurrence of the phrase
+            start = lower.find(indicator) + len(indicator)
+            end = lower.find(indicator, start)
+            words = lower[start:end if end != -1 else len(lower)].split()
+            name = words[0].capitalize() if words else ""
+            if len(name) > 2:  # Avoid picking up small words
+                return name
+        return None
+
+
+default_analyzer = MessageAnalyzer()
+
+
+def analyze_message(query):
+    return default_analyzer.analyze(query)
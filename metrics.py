@@ -0,0 +1,141 @@
+"""
+In-process counters and latency histograms for the bot pipeline, with a
+Prometheus text rendering for /metrics endpoints.
+
+Counters are keyed by name plus optional labels, e.g.
+inc("replies_total", intent="office_inquiry", path="fast"). Stage timings
+are recorded with `with span("gemini"): ...` into the
+stage_duration_seconds histogram. Both cost a lock and a few additions, so
+they can stay on in production.
+
+Values are per process: with several gunicorn workers each exposes its own.
+"""
+import time
+import bisect
+import threading
+
+# Upper bounds in seconds, covering in-process stages (~10 us) up to slow
+# LLM calls
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_collectors = []
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def get(name, **labels):
+    return _counters.get(_key(name, labels), 0)
+
+
+def observe(name, value, **labels):
+    """Record one observation (in seconds) in a histogram."""
+    _observe(_key(name, labels), value)
+
+
+def _observe(key, value):
+    index = bisect.bisect_left(BUCKETS, value)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+class span:
+    """Time a block into stage_duration_seconds{stage=...}."""
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _observe(("stage_duration_seconds", (("stage", self.stage),)), time.perf_counter() - self.start)
+        return False
+
+
+def register_collector(collect):
+    """
+    Add a callable returning (name, type, labels, value) samples, read at
+    render time. Used to export stats that components already keep.
+    """
+    _collectors.append(collect)
+
+
+def snapshot():
+    """Return {(name, ((label, value), ...)): count} for every counter."""
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render():
+    """Render every metric in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(h[0]), h[1], h[2]) for key, h in _histograms.items()}
+
+    samples = {}
+    for (name, labels), value in counters.items():
+        samples.setdefault((name, "counter"), []).append((labels, value))
+    for collect in _collectors:
+        try:
+            for name, kind, labels, value in collect():
+                samples.setdefault((name, kind), []).append((tuple(sorted(labels.items())), value))
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
+
+    lines = []
+    for (name, kind), values in sorted(samples.items()):
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(values):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    by_name = {}
+    for (name, labels), histogram in histograms.items():
+        by_name.setdefault(name, []).append((labels, histogram))
+    for name, entries in sorted(by_name.items()):
+        lines.append(f"# TYPE {name} histogram")
+        for labels, (buckets, total, count) in sorted(entries):
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,186 @@
+"""
+Out-of-band delivery of bot replies through the Twilio Messages REST API.
+
+Used by the connector's async reply mode: the webhook is acknowledged at
+once and the reply is posted here when the bot has produced it.
+"""
+import json
+import time
+import queue
+import random
+import threading
+import xml.etree.ElementTree as ET
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+# Statuses that mean Twilio turned the request away before creating the
+# message, so sending again cannot produce a duplicate. 500/502/504 are not
+# retried: a gateway can time out after the message was created.
+RETRY_STATUSES = (429, 503)
+
+
+class OutboundError(Exception):
+    pass
+
+
+def parse_twiml_body(twiml):
+    """Return the text of the <Message> elements in a TwiML response."""
+    try:
+        root = ET.fromstring(twiml)
+    except ET.ParseError:
+        # Not TwiML; treat it as the message text itself
+        return twiml
+    parts = []
+    for message in root.iter("Message"):
+        body = message.find("Body")
+        text = body.text if body is not None else message.text
+        if text:
+            parts.append(text)
+    return "\n".join(parts)
+
+
+def _not_sent(error):
+    """
+    Whether a connection error happened before the request was written
+    (refused, DNS failure, connect timeout). Errors after that, such as a
+    reset while reading the response, may follow a created message.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    # NewConnectionError is a subclass of ConnectTimeoutError
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class MessageSender:
+    """
+    Interface for anything that can deliver a WhatsApp message. With
+    content_sid the message is an approved template filled in from
+    content_variables, and body is not sent.
+    """
+
+    def send(self, to, body, from_number=None, content_sid=None, content_variables=None):
+        raise NotImplementedError
+
+
+class TwilioRestSender(MessageSender):
+    """
+    Posts messages to the Twilio Messages API. Each thread reuses its own
+    HTTP session (keep-alive connections). Only failures where Twilio cannot
+    have created the message are retried, with jittered exponential backoff
+    honouring Retry-After: a 429 or 503 status, or a connection that could
+    not be opened. Anything else (other 5xx, a connection dropped after the
+    request went out, a read timeout) raises OutboundError rather than risk
+    the donor getting the reply twice.
+
+    base_url can point at a local stub such as fake_twilio.py.
+    """
+
+    def __init__(self, account_sid, auth_token, from_number, base_url="https://api.twilio.com",
+                 timeout=10, retries=3, backoff=0.5, max_backoff=8):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.auth = (self.account_sid, self.auth_token)
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._local.session = session
+        return session
+
+    def send(self, to, body, from_number=None, content_sid=None, content_variables=None):
+        """Send one message and return its SID. Raises OutboundError on failure."""
+        data = {"To": to, "From": from_number or self.from_number}
+        if content_sid:
+            data["ContentSid"] = content_sid
+            data["ContentVariables"] = json.dumps(content_variables or {})
+        else:
+            data["Body"] = body
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                response = self._session().post(self.url, data=data, timeout=self.timeout)
+            except requests.ConnectionError as e:
+                if not _not_sent(e):
+                    raise OutboundError(f"Connection failed after the request was sent: {e}")
+                error = f"connection error: {e}"
+            except requests.Timeout as e:
+                raise OutboundError(f"No response from Twilio: {e}")
+            else:
+                if response.status_code < 300:
+                    return response.json().get("sid")
+                if response.status_code not in RETRY_STATUSES:
+                    raise OutboundError(f"Twilio returned {response.status_code}: {response.text[:200]}")
+                error = f"Twilio returned {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt == self.retries:
+                raise OutboundError(f"Giving up after {attempt + 1} attempts, {error}")
+            try:
+                wait = float(retry_after) if retry_after else delay * random.uniform(0.5, 1.0)
+            except ValueError:
+                wait = delay * random.uniform(0.5, 1.0)
+            time.sleep(min(wait, self.max_backoff))
+            delay = min(delay * 2, self.max_backoff)
+
+
+class OutboundQueue:
+    """
+    Bounded queue of replies drained by a few sender threads, so slow or
+    retried REST calls never hold up the code that produced the reply.
+    """
+
+    def __init__(self, sender, workers=4, max_queued=1000):
+        self.sender = sender
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.sent = 0
+        self.failed = 0
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"outbound-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def put(self, to, body, from_number=None):
+        """Queue a message. Returns False if the queue is full."""
+        self.start()
+        try:
+            self.queue.put_nowait((to, body, from_number))
+            return True
+        except queue.Full:
+            return False
+
+    def _work(self):
+        while True:
+            to, body, from_number = self.queue.get()
+            try:
+                self.sender.send(to, body, from_number)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error delivering reply to {to}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """Block until every queued message has been attempted."""
+        self.queue.join()
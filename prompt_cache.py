@@ -0,0 +1,124 @@
+import time
+import asyncio
+from google.genai import types
+from donor_context import estimate_tokens
+
+
+def cache_is_missing(error):
+    """
+    Whether a failed request failed because its cached content is gone
+    (expired or deleted), as opposed to overload, timeouts and the like,
+    which say nothing about the cache.
+    """
+    code = getattr(error, "code", None)
+    if code == 404:
+        return True
+    return code == 400 and "cachedcontent" in str(error).replace(" ", "").lower()
+
+
+class PromptCache:
+    """
+    Keeps the static part of the system prompt registered as Gemini cached
+    content so each request only carries the per-donor context.
+
+    The cache TTL is extended shortly before it expires. If the cache cannot
+    be created (quota, prompt below the model's minimum cache size, ...) we
+    return None and callers send the full prompt inline until retry_after
+    has passed.
+
+    Gemini only caches prompts of at least min_tokens (4096 for
+    gemini-2.0-flash). Shorter instructions are never sent to the cache API,
+    so they don't cost a failing create call every retry_after seconds; pad
+    the instruction or lower min_tokens for models with a smaller minimum.
+    """
+
+    def __init__(self, client, model, system_instruction, ttl_seconds=3600,
+                 refresh_margin=300, retry_after=600, min_tokens=4096):
+        self.client = client
+        self.model = model
+        self.system_instruction = system_instruction
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+
+        self.name = None
+        self.expires_at = 0
+        self.disabled_until = 0
+        self._lock = asyncio.Lock()
+
+        self.too_small = estimate_tokens(system_instruction) < min_tokens
+        if self.too_small:
+            print(f"Prompt of about {estimate_tokens(system_instruction)} tokens is below the "
+                  f"{min_tokens}-token minimum for context caching; sending it inline")
+
+        # Counters for monitoring
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def _is_fresh(self, now):
+        return self.name is not None and now < self.expires_at - self.refresh_margin
+
+    async def get_name(self):
+        """Return the cached content name, creating or refreshing it as needed."""
+        if self.too_small:
+            return None
+        if self._is_fresh(time.time()):
+            self.hits += 1
+            return self.name
+
+        if time.time() < self.disabled_until:
+            return None
+
+        async with self._lock:
+            # Another request may have refreshed the cache while we waited
+            now = time.time()
+            if self._is_fresh(now):
+                self.hits += 1
+                return self.name
+
+            try:
+                if self.name is not None and now < self.expires_at:
+                    cached = await self.client.aio.caches.update(
+                        name=self.name,
+                        config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+                    )
+                    self.refreshes += 1
+                    self.hits += 1
+                else:
+                    cached = await self.client.aio.caches.create(
+                        model=self.model,
+                        config=types.CreateCachedContentConfig(
+                            system_instruction=self.system_instruction,
+                            ttl=f"{self.ttl_seconds}s",
+                            display_name="receptionist-prompt"
+                        )
+                    )
+                    self.misses += 1
+            except Exception as e:
+                print(f"Error creating context cache: {e}")
+                self.errors += 1
+                self.name = None
+                self.disabled_until = now + self.retry_after
+                return None
+
+            self.name = cached.name
+            if cached.expire_time:
+                self.expires_at = cached.expire_time.timestamp()
+            else:
+                self.expires_at = now + self.ttl_seconds
+            return self.name
+
+    def invalidate(self):
+        """Forget the current cache, e.g. after Gemini reports it missing."""
+        self.name = None
+        self.expires_at = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+        }
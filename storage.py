@@ -0,0 +1,312 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from conversation_store import ConversationStore
+
+
+class MemoryStorage:
+    """
+    Conversation history and reply cache kept in process memory.
+    Fast, but lost on restart and private to one bot process.
+
+    Cached replies expire after response_ttl seconds; beyond max_responses
+    the least recently used reply is dropped.
+    """
+
+    def __init__(self, conversation_store=None, max_responses=1000, response_ttl=600):
+        self.conversations = conversation_store if conversation_store is not None else ConversationStore()
+        self.max_responses = max_responses
+        self.response_ttl = response_ttl
+        self.responses = OrderedDict()
+
+    async def get_history(self, phone_number):
+        return self.conversations.get(phone_number)
+
+    async def append_turn(self, phone_number, user_message, assistant_message):
+        self.conversations.append(phone_number, user_message, assistant_message)
+
+    async def get_summary(self, phone_number):
+        return self.conversations.get_summary(phone_number)
+
+    async def set_summary(self, phone_number, summary, through):
+        self.conversations.set_summary(phone_number, summary, through)
+
+    async def get_cached_response(self, cache_key):
+        entry = self.responses.get(cache_key)
+        if entry is None:
+            return None
+        response, created_at = entry
+        if time.monotonic() - created_at > self.response_ttl:
+            del self.responses[cache_key]
+            return None
+        self.responses.move_to_end(cache_key)
+        return response
+
+    async def cache_response(self, cache_key, response):
+        self.responses[cache_key] = (response, time.monotonic())
+        self.responses.move_to_end(cache_key)
+        while len(self.responses) > self.max_responses:
+            self.responses.popitem(last=False)
+
+    async def close(self):
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_phone ON messages (phone, id);
+CREATE INDEX IF NOT EXISTS idx_messages_created ON messages (created_at);
+
+CREATE TABLE IF NOT EXISTS responses (
+    cache_key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_created ON responses (created_at);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    phone TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    through REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteStorage:
+    """
+    Conversation history and reply cache in a SQLite database in WAL mode.
+
+    Several bot processes can point at the same file and share
+    conversations, and state survives restarts. Writes are buffered in
+    memory and committed in batches by a background task, so a reply never
+    waits on an fsync. Reads of numbers with unflushed writes also see the
+    buffered rows.
+    """
+
+    def __init__(self, path, max_turns=5, idle_ttl=24 * 3600, response_ttl=600,
+                 flush_interval=0.05, batch_size=200, read_threads=4):
+        self.path = path
+        self.max_messages = max_turns * 2
+        self.idle_ttl = idle_ttl
+        self.response_ttl = response_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._local = threading.local()
+        self._readers = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix="sqlite-read")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-write")
+
+        self._pending_messages = []
+        self._pending_responses = {}
+        # Batch currently being committed, still visible to readers
+        self._flushing_messages = []
+        self._flushing_responses = {}
+        self._flush_event = None
+        self._writer_task = None
+        self._last_cleanup = 0
+
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+        connection.commit()
+
+    def _connection(self):
+        """One connection per thread, as sqlite3 connections are not thread-safe."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    async def _read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, fn, *args)
+
+    def _start_writer(self):
+        if self._writer_task is None or self._writer_task.done():
+            self._flush_event = asyncio.Event()
+            self._writer_task = asyncio.create_task(self._write_loop())
+
+    # History
+
+    def _select_history(self, phone_number):
+        rows = self._connection().execute(
+            "SELECT role, content, created_at FROM messages WHERE phone = ? AND created_at > ? ORDER BY id DESC LIMIT ?",
+            (phone_number, time.time() - self.idle_ttl, self.max_messages)
+        ).fetchall()
+        rows.reverse()
+        return rows
+
+    async def get_history(self, phone_number):
+        rows = await self._read(self._select_history, phone_number)
+
+        # Add writes that have not been committed yet. A batch may be committed
+        # while we read, so skip rows the database already returned.
+        seen = set(rows)
+        for phone, role, content, created_at in self._flushing_messages + self._pending_messages:
+            if phone == phone_number and (role, content, created_at) not in seen:
+                rows.append((role, content, created_at))
+
+        return [{"role": role, "content": content, "at": created_at} for role, content, created_at in rows[-self.max_messages:]]
+
+    async def append_turn(self, phone_number, user_message, assistant_message):
+        now = time.time()
+        self._pending_messages.append((phone_number, "user", user_message, now))
+        self._pending_messages.append((phone_number, "assistant", assistant_message, now))
+        self._schedule_flush()
+
+    # Rolling summaries. Written rarely, so they skip the batch buffer.
+
+    def _select_summary(self, phone_number):
+        row = self._connection().execute(
+            "SELECT summary, through FROM summaries WHERE phone = ? AND updated_at > ?",
+            (phone_number, time.time() - self.idle_ttl)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    async def get_summary(self, phone_number):
+        return await self._read(self._select_summary, phone_number)
+
+    def _write_summary(self, phone_number, summary, through):
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO summaries (phone, summary, through, updated_at) VALUES (?, ?, ?, ?)",
+                (phone_number, summary, through, time.time())
+            )
+
+    async def set_summary(self, phone_number, summary, through):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self._write_summary, phone_number, summary, through)
+
+    # Reply cache
+
+    def _select_response(self, cache_key):
+        row = self._connection().execute(
+            "SELECT response FROM responses WHERE cache_key = ? AND created_at > ?",
+            (cache_key, time.time() - self.response_ttl)
+        ).fetchone()
+        return row[0] if row else None
+
+    async def get_cached_response(self, cache_key):
+        for buffered in (self._pending_responses, self._flushing_responses):
+            if cache_key in buffered:
+                return buffered[cache_key][0]
+        return await self._read(self._select_response, cache_key)
+
+    async def cache_response(self, cache_key, response):
+        self._pending_responses[cache_key] = (response, time.time())
+        self._schedule_flush()
+
+    # Batched writes
+
+    def _schedule_flush(self):
+        self._start_writer()
+        if len(self._pending_messages) + len(self._pending_responses) >= self.batch_size:
+            self._flush_event.set()
+
+    async def _write_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Commit buffered writes in one transaction."""
+        if not self._pending_messages and not self._pending_responses:
+            return
+        messages, self._pending_messages = self._pending_messages, []
+        responses, self._pending_responses = self._pending_responses, {}
+        self._flushing_messages, self._flushing_responses = messages, responses
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._writer, self._write_batch, messages, responses)
+        except Exception as e:
+            print(f"Error writing conversation batch: {e}")
+            # Put the batch back so it is retried with the next flush
+            self._pending_messages = messages + self._pending_messages
+            for key, value in responses.items():
+                self._pending_responses.setdefault(key, value)
+        finally:
+            self._flushing_messages, self._flushing_responses = [], {}
+
+    def _write_batch(self, messages, responses):
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.executemany(
+                "INSERT INTO messages (phone, role, content, created_at) VALUES (?, ?, ?, ?)",
+                messages
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO responses (cache_key, response, created_at) VALUES (?, ?, ?)",
+                [(key, response, created_at) for key, (response, created_at) in responses.items()]
+            )
+
+            # Keep only the most recent messages for every number we touched
+            for phone_number in {m[0] for m in messages}:
+                connection.execute(
+                    """DELETE FROM messages WHERE phone = ? AND id <= (
+                        SELECT id FROM messages WHERE phone = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )""",
+                    (phone_number, phone_number, self.max_messages)
+                )
+
+            # Expire idle conversations and old replies about once a minute
+            if now - self._last_cleanup > 60:
+                connection.execute("DELETE FROM messages WHERE created_at < ?", (now - self.idle_ttl,))
+                connection.execute("DELETE FROM summaries WHERE updated_at < ?", (now - self.idle_ttl,))
+                connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.response_ttl,))
+                self._last_cleanup = now
+
+    async def close(self):
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self._readers.shutdown()
+        self._writer.shutdown()
+
+
+def create_storage(kind, **options):
+    """Build the storage backend named by HISTORY_BACKEND ("memory" or "sqlite")."""
+    if kind == "sqlite":
+        return SQLiteStorage(
+            options.get("path", "conversations.db"),
+            max_turns=options.get("max_turns", 5),
+            idle_ttl=options.get("idle_ttl", 24 * 3600),
+            response_ttl=options.get("response_ttl", 600),
+        )
+    if kind == "memory":
+        return MemoryStorage(
+            ConversationStore(
+                max_turns=options.get("max_turns", 5),
+                idle_ttl=options.get("idle_ttl", 24 * 3600),
+                max_entries=options.get("max_entries", 10000),
+            ),
+            max_responses=options.get("max_responses", 1000),
+            response_ttl=options.get("response_ttl", 600),
+        )
+    raise ValueError(f"Unknown history backend: {kind}")
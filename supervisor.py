@@ -0,0 +1,236 @@
+"""
+Multi-core bot server: runs WORKERS copies of whatsapp_bot.py, each in its
+own process, behind a router on the usual WebSocket port.
+
+    WORKERS=4 python supervisor.py
+
+Every message is forwarded to a worker chosen by a consistent hash of its
+From number, so a donor's conversation history, reply cache and in-flight
+generations all stay in one worker. Workers listen on 127.0.0.1 from
+WORKER_BASE_PORT upwards and are restarted, with backoff, if they exit. While
+a worker is down its donors' messages wait for it to come back (until their
+deadline) rather than being moved, since another worker would not have their
+history (with HISTORY_BACKEND=sqlite it is shared, but the reply cache is
+not). Each worker still serves its own /metrics on its port.
+
+The router speaks the same protocol as the bot, so the connector works
+unchanged. Admission limits apply per worker, so RATE_LIMIT_GLOBAL and
+ADMISSION_MAX_PENDING should be divided by WORKERS when set.
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import signal
+import asyncio
+import hashlib
+import subprocess
+from http import HTTPStatus
+import websockets
+from dotenv import load_dotenv
+from twilio.twiml.messaging_response import MessagingResponse
+from ws_pool import WebSocketPool
+import metrics
+
+load_dotenv()
+
+WORKERS = int(os.getenv("WORKERS", os.cpu_count() or 1))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 8801))
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", 2))
+ROUTER_HOST = os.getenv("WEBSOCKET_HOST", "0.0.0.0")
+ROUTER_PORT = int(os.getenv("WEBSOCKET_PORT", 8765))
+ROUTER_TIMEOUT = 30
+
+# Restart backoff for workers that keep dying; reset once one stays up
+MIN_RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+STABLE_AFTER = 60
+
+UNAVAILABLE_MESSAGE = "I'm sorry, our service is temporarily unavailable. Please try again later."
+
+
+class HashRing:
+    """
+    Consistent hash ring over node indexes. Each node gets `replicas` points
+    on the ring, so keys spread evenly and changing the number of nodes only
+    moves about 1/N of them.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        points = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def node_for(self, key):
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class Worker:
+    """One whatsapp_bot.py process on a private port, restarted if it exits."""
+
+    def __init__(self, index, port):
+        self.index = index
+        self.port = port
+        self.process = None
+        self.started = 0
+        self.restart_delay = MIN_RESTART_DELAY
+        self.pool = WebSocketPool(f"ws://127.0.0.1:{port}", size=WORKER_POOL_SIZE, timeout=ROUTER_TIMEOUT)
+
+    def start(self):
+        env = dict(os.environ, WEBSOCKET_HOST="127.0.0.1", WEBSOCKET_PORT=str(self.port))
+        self.process = subprocess.Popen([sys.executable, "whatsapp_bot.py"],
+                                        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+        self.started = time.monotonic()
+        print(f"Started worker {self.index} (pid {self.process.pid}) on port {self.port}")
+
+    async def watch(self, stopping):
+        """Restart the process whenever it exits, until stopping is set."""
+        while not stopping.is_set():
+            await asyncio.sleep(0.5)
+            code = self.process.poll()
+            if code is None or stopping.is_set():
+                continue
+
+            print(f"Worker {self.index} exited with code {code}")
+            metrics.inc("worker_restarts_total", worker=str(self.index))
+            if time.monotonic() - self.started > STABLE_AFTER:
+                self.restart_delay = MIN_RESTART_DELAY
+            await asyncio.sleep(self.restart_delay)
+            self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+            if not stopping.is_set():
+                self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class Router:
+    """Accepts bot-protocol WebSocket connections and forwards each message to its worker."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.ring = HashRing(range(len(workers)))
+
+    def worker_for(self, phone_number):
+        return self.workers[self.ring.node_for(phone_number or "")]
+
+    async def forward(self, data):
+        """Return the worker's TwiML reply, or None if the sender has stopped waiting."""
+        worker = self.worker_for(data.get("From"))
+        metrics.inc("router_messages_total", worker=str(worker.index))
+        payload = {key: value for key, value in data.items() if key not in ("id", "deadline")}
+        deadline = data.get("deadline")
+        timeout = ROUTER_TIMEOUT if deadline is None else deadline - time.time()
+        if timeout <= 0:
+            return None
+        try:
+            with metrics.span("router_forward"):
+                return await worker.pool.request(payload, timeout)
+        except asyncio.TimeoutError:
+            return None
+        except Exception as e:
+            print(f"Worker {worker.index} unavailable: {e}")
+            metrics.inc("router_unavailable_total", worker=str(worker.index))
+            return reply_text(UNAVAILABLE_MESSAGE)
+
+    def serve_http(self, connection, request):
+        """
+        Plain HTTP on the router port: /health (503 until every worker is
+        connected) and the router's own /metrics.
+        """
+        if request.path == "/health":
+            if not all(worker.pool.is_connected() for worker in self.workers):
+                return connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Starting")
+            return connection.respond(HTTPStatus.OK, "OK")
+        if request.path == "/metrics":
+            return connection.respond(HTTPStatus.OK, metrics.render())
+        return None
+
+    async def handle(self, websocket, path=None):
+        in_flight = {}
+
+        async def answer(request_id, data):
+            try:
+                reply = await self.forward(data)
+                if reply is not None:
+                    await websocket.send(json.dumps({"id": request_id, "Body": reply}))
+            except Exception as e:
+                print(f"Error forwarding message: {e}")
+            finally:
+                in_flight.pop(request_id, None)
+
+        try:
+            async for message in websocket:
+                try:
+                    data = json.loads(message)
+                except json.JSONDecodeError:
+                    await websocket.send(reply_text("Error: Invalid JSON format."))
+                    continue
+
+                request_id = data.get("id")
+                if request_id is None:
+                    # Untagged clients match replies by order, one at a time
+                    reply = await self.forward(data)
+                    if reply is not None:
+                        await websocket.send(reply)
+                elif data.get("cancel"):
+                    task = in_flight.pop(request_id, None)
+                    if task is not None:
+                        task.cancel()
+                else:
+                    in_flight[request_id] = asyncio.create_task(answer(request_id, data))
+        finally:
+            for task in list(in_flight.values()):
+                task.cancel()
+
+
+def reply_text(text):
+    response = MessagingResponse()
+    response.message(text)
+    return str(response)
+
+
+async def main():
+    workers = [Worker(index, WORKER_BASE_PORT + index) for index in range(WORKERS)]
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    for worker in workers:
+        worker.start()
+        await worker.pool.attach()
+    watchers = [asyncio.create_task(worker.watch(stopping)) for worker in workers]
+
+    router = Router(workers)
+    server = await websockets.serve(router.handle, ROUTER_HOST, ROUTER_PORT, process_request=router.serve_http)
+    print(f"Router running on ws://{ROUTER_HOST}:{ROUTER_PORT} with {WORKERS} workers")
+    try:
+        await stopping.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        for task in watchers:
+            task.cancel()
+        for worker in workers:
+            await worker.pool.aclose()
+            worker.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+"""
+The single-pass analyzer must give the same results as the original
+identify_intent/extract_info_from_query, kept as the reference in
+benchmarks/bench_intent_engine.py.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from intent_engine import analyze_message  # noqa: E402
+from bench_intent_engine import GOLDEN_CORPUS, fuzz_corpus, legacy  # noqa: E402
+
+
+def compare(query):
+    try:
+        expected = legacy(query)
+    except IndexError:
+        # The original crashes when a name phrase ends the message
+        pytest.skip("legacy extractor raises on this message")
+    assert analyze_message(query) == expected
+
+
+@pytest.mark.parametrize("query", GOLDEN_CORPUS)
+def test_golden_corpus(query):
+    compare(query)
+
+
+def test_fuzz_corpus():
+    for query in fuzz_corpus(3000):
+        try:
+            expected = legacy(query)
+        except IndexError:
+            continue
+        assert analyze_message(query) == expected, query
+
+
+def test_text_longer_when_lowercased():
+    assert analyze_message("name İs Ravi") == {
+        "intent": "general_inquiry", "utr": None, "amount": None, "phone": None, "name": None,
+    }
+    info = analyze_message("İİ paid ₹750, UTR42 from +91 9876543210")
+    assert (info["amount"], info["utr"], info["phone"]) == ("750", "UTR42", "+91 9876543210")
@@ -0,0 +1,133 @@
+"""
+process_message coalesces identical in-flight messages, cancels a generation
+nobody waits for any more, and only caches replies Gemini actually produced.
+"""
+import os
+import sys
+import asyncio
+import itertools
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("USE_FAKE_GEMINI", "1")
+
+import whatsapp_bot  # noqa: E402
+from whatsapp_bot import GenerationError, GENERATION_ERROR_MESSAGE, process_message  # noqa: E402
+
+_numbers = itertools.count(1)
+
+
+@pytest.fixture
+def phone():
+    # A fresh number per test keeps the reply cache from leaking between them
+    return f"whatsapp:+4420000{next(_numbers):05d}"
+
+
+class SlowGeneration:
+    """Stands in for generate_response, blocking until release() is called."""
+
+    def __init__(self, fail_first=False):
+        self.calls = 0
+        self.cancelled = 0
+        self.fail_first = fail_first
+        self.started = asyncio.Event()
+        self.released = asyncio.Event()
+
+    def release(self):
+        self.released.set()
+
+    async def __call__(self, query, phone_number):
+        self.calls += 1
+        self.started.set()
+        try:
+            await self.released.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail_first and self.calls == 1:
+            raise GenerationError("503 The model is overloaded")
+        return f"reply {self.calls} to {query}"
+
+
+def run(monkeypatch, generation, scenario):
+    monkeypatch.setattr(whatsapp_bot, "generate_response", generation)
+    return asyncio.run(scenario())
+
+
+def test_duplicates_share_one_generation(monkeypatch, phone):
+    generation = SlowGeneration()
+
+    async def scenario():
+        first = asyncio.ensure_future(process_message(phone, "hello"))
+        second = asyncio.ensure_future(process_message(phone, "hello"))
+        await generation.started.wait()
+        generation.release()
+        return await asyncio.gather(first, second)
+
+    first, second = run(monkeypatch, generation, scenario)
+    assert first == second
+    assert "reply 1 to hello" in first
+    assert generation.calls == 1
+
+
+def test_one_waiter_leaving_keeps_the_generation(monkeypatch, phone):
+    generation = SlowGeneration()
+
+    async def scenario():
+        first = asyncio.ensure_future(process_message(phone, "hello"))
+        second = asyncio.ensure_future(process_message(phone, "hello"))
+        await generation.started.wait()
+        first.cancel()
+        await asyncio.sleep(0)
+        generation.release()
+        return await second
+
+    assert "reply 1 to hello" in run(monkeypatch, generation, scenario)
+    assert generation.cancelled == 0
+
+
+def test_last_waiter_leaving_cancels_the_generation(monkeypatch, phone):
+    generation = SlowGeneration()
+
+    async def scenario():
+        caller = asyncio.ensure_future(process_message(phone, "hello"))
+        await generation.started.wait()
+        caller.cancel()
+        await asyncio.sleep(0.01)
+        return f"{phone}:hello" in whatsapp_bot.in_flight_replies
+
+    assert run(monkeypatch, generation, scenario) is False
+    assert generation.cancelled == 1
+
+
+def test_duplicate_after_cancel_starts_a_new_generation(monkeypatch, phone):
+    generation = SlowGeneration()
+
+    async def scenario():
+        first = asyncio.ensure_future(process_message(phone, "hello"))
+        await generation.started.wait()
+        first.cancel()
+        # The cancelled generation hasn't finished unwinding yet
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(process_message(phone, "hello"))
+        await asyncio.sleep(0)
+        generation.release()
+        return await second
+
+    assert "to hello" in run(monkeypatch, generation, scenario)
+    assert generation.calls == 2
+
+
+def test_failed_generation_is_not_cached(monkeypatch, phone):
+    generation = SlowGeneration(fail_first=True)
+    generation.release()
+
+    async def scenario():
+        return await process_message(phone, "hello"), await process_message(phone, "hello")
+
+    apology, retry = run(monkeypatch, generation, scenario)
+    assert GENERATION_ERROR_MESSAGE.split("!")[0] in apology
+    assert "reply 2 to hello" in retry
+    assert generation.calls == 2
@@ -1,28 +1,67 @@
 import os
 import json
+import time
 import asyncio
 import websockets
+import threading
 import requests
 from flask import Flask, request
 from twilio.twiml.messaging_response import MessagingResponse
 from dotenv import load_dotenv
+from ws_pool import WebSocketPool
+import metrics
+from outbound import TwilioRestSender, OutboundQueue, parse_twiml_body
 
 load_dotenv()
 
 app = Flask(__name__)
 WEBSOCKET_URL = os.getenv("WEBSOCKET_URL", "ws://localhost:8765")  # Use environment variable
+WEBSOCKET_TIMEOUT = 30
+
+# Persistent connections to the WebSocket server, shared by all requests in
+# this worker. Set WEBSOCKET_POOL_SIZE=0 to open one connection per message.
+WEBSOCKET_POOL_SIZE = int(os.getenv("WEBSOCKET_POOL_SIZE", 4))
+ws_pool = WebSocketPool(WEBSOCKET_URL, size=WEBSOCKET_POOL_SIZE, timeout=WEBSOCKET_TIMEOUT)
+
+# REPLY_MODE=async acknowledges the webhook immediately and sends the reply
+# through the Twilio REST API once the bot has produced it, instead of holding
+# the request (and a worker) open for the whole LLM round trip. Needs the pool.
+REPLY_MODE = os.getenv("REPLY_MODE", "sync")
+ASYNC_MAX_PENDING = int(os.getenv("ASYNC_MAX_PENDING", 1000))
+async_slots = threading.BoundedSemaphore(ASYNC_MAX_PENDING)
+outbound_queue = OutboundQueue(
+    TwilioRestSender(
+        os.getenv("TWILIO_ACCOUNT_SID", ""),
+        os.getenv("TWILIO_AUTH_TOKEN", ""),
+        os.getenv("TWILIO_WHATSAPP_NUMBER", ""),
+        base_url=os.getenv("TWILIO_API_BASE_URL", "https://api.twilio.com"),
+    ),
+    workers=int(os.getenv("OUTBOUND_WORKERS", 4)),
+    max_queued=ASYNC_MAX_PENDING,
+)
+
+UNAVAILABLE_MESSAGE = "I'm sorry, our service is temporarily unavailable. Please try again later."
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Simple health check endpoint for Render.com."""
     return "OK", 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for this worker process."""
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """
     Twilio webhook endpoint - receives WhatsApp messages from Twilio
     and forwards them to the WebSocket server
     """
+    with metrics.span("connector_webhook"):
+        return handle_webhook()
+
+def handle_webhook():
     from_number = request.form.get('From')
     message_body = request.form.get('Body')
 
@@ -33,27 +72,65 @@ def webhook():
         response.message("Error: Could not process your message.")
         return str(response)
 
+    if REPLY_MODE == "async" and WEBSOCKET_POOL_SIZE > 0:
+        return queue_for_async_reply(from_number, message_body, request.form.get('To'))
+
     try:
         # Forward to WebSocket server asynchronously
-        response_text = send_to_websocket(from_number, message_body)
+        with metrics.span("connector_roundtrip"):
+            response_text = send_to_websocket(from_number, message_body)
 
         # If we didn't get a response from WebSocket, use fallback
         if not response_text:
+            metrics.inc("connector_fallback_replies_total", reason="unavailable")
             response = MessagingResponse()
-            response.message("I'm sorry, our service is temporarily unavailable. Please try again later.")
+            response.message(UNAVAILABLE_MESSAGE)
             return str(response)
 
         return response_text
 
     except Exception as e:
         print(f"Error handling webhook: {e}")
+        metrics.inc("connector_fallback_replies_total", reason="error")
         response = MessagingResponse()
         response.message("I'm sorry, there was an error processing your request.")
         return str(response)
 
+def queue_for_async_reply(from_number, message_body, to_number=None):
+    """
+    Hand the message to the bot without waiting and acknowledge Twilio with
+    empty TwiML. The reply goes out through the outbound queue, from the
+    number the donor wrote to.
+    """
+    if not async_slots.acquire(blocking=False):
+        metrics.inc("connector_fallback_replies_total", reason="busy")
+        response = MessagingResponse()
+        response.message(UNAVAILABLE_MESSAGE)
+        return str(response)
+
+    def deliver(reply):
+        try:
+            body = parse_twiml_body(reply) if reply else UNAVAILABLE_MESSAGE
+            if body and not outbound_queue.put(from_number, body, to_number):
+                print(f"Outbound queue full, dropping reply to {from_number}")
+        finally:
+            async_slots.release()
+
+    ws_pool.submit(from_number, message_body, deliver)
+    return str(MessagingResponse())
+
 def send_to_websocket(from_number, message_body):
     """
     Send message to WebSocket server and wait for response
+    Uses the shared connection pool unless it is disabled
+    """
+    if WEBSOCKET_POOL_SIZE > 0:
+        return ws_pool.send(from_number, message_body)
+    return send_to_websocket_unpooled(from_number, message_body)
+
+def send_to_websocket_unpooled(from_number, message_body):
+    """
+    Send message over a fresh WebSocket connection and wait for response
     This is a blocking wrapper around the async function
     """
     loop = asyncio.new_event_loop()
@@ -72,16 +149,19 @@ async def async_send_to_websocket(from_number, message_body):
     try:
         async with websockets.connect(WEBSOCKET_URL) as websocket:
             # Prepare message for WebSocket server
+            # The bot stops working on the message once we stop waiting;
+            # closing the connection on timeout cancels it outright
             message = json.dumps({
                 "From": from_number,
-                "Body": message_body
+                "Body": message_body,
+                "deadline": time.time() + WEBSOCKET_TIMEOUT
             })
 
             # Send message to WebSocket server
             await websocket.send(message)
 
             # Wait for response (with timeout)
-            response = await asyncio.wait_for(websocket.recv(), timeout=30)
+            response = await asyncio.wait_for(websocket.recv(), timeout=WEBSOCKET_TIMEOUT)
             return response
 
     except asyncio.TimeoutError:
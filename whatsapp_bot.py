@@ -1,22 +1,98 @@
 import os
-import re
+import time
 import random
 import asyncio
+import contextvars
 import websockets
+import httpx
 import json
-from datetime import datetime, timedelta
+from http import HTTPStatus
+from collections import deque
+from datetime import datetime
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 from twilio.twiml.messaging_response import MessagingResponse
+from prompt_cache import PromptCache, cache_is_missing
+from dispatcher import MessageDispatcher
+from storage import create_storage
+from donor_repository import DonorRepository
+from donor_context import DonorContextRenderer, estimate_tokens
+from history_manager import HistoryManager
+from admission import AdmissionController, ADMITTED, NUMBER_RATE
+from intent_engine import analyze_message
+from fast_path import FastPathResponder
+import metrics
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Set up Gemini API key from .env file
-client = genai.Client(
-    api_key=os.getenv("GEMINI_API_KEY"),
+# Set up Gemini API key from .env file (USE_FAKE_GEMINI=1 runs fully offline)
+if os.getenv("USE_FAKE_GEMINI") == "1":
+    from fake_genai import FakeClient
+    client = FakeClient(
+        latency=float(os.getenv("FAKE_GEMINI_LATENCY", 0)),
+        jitter=float(os.getenv("FAKE_GEMINI_JITTER", 0)),
+        failure_rate=float(os.getenv("FAKE_GEMINI_FAILURE_RATE", 0)),
+    )
+else:
+    client = genai.Client(
+        api_key=os.getenv("GEMINI_API_KEY"),
+    )
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+
+# Context caching for the static part of the first-contact prompt
+ENABLE_CONTEXT_CACHE = os.getenv("ENABLE_CONTEXT_CACHE", "1") == "1"
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", 3600))
+# Gemini's minimum cacheable prompt size for GEMINI_MODEL
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 4096))
+
+# Maximum number of Gemini requests allowed in flight at once
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("MAX_CONCURRENT_LLM_CALLS", 64))
+llm_semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+
+# Gemini calls time out after GEMINI_TIMEOUT seconds and are retried up to
+# GEMINI_MAX_RETRIES times on overload, server errors and network failures,
+# with jittered exponential backoff from GEMINI_RETRY_BACKOFF seconds.
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 20))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 2))
+GEMINI_RETRY_BACKOFF = float(os.getenv("GEMINI_RETRY_BACKOFF", 0.5))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Hedged requests: if a call hasn't answered after GEMINI_HEDGE_AFTER seconds
+# a second identical one is sent and the first answer wins. "auto" uses the
+# p95 of recent call latencies; unset disables hedging.
+GEMINI_HEDGE_AFTER = os.getenv("GEMINI_HEDGE_AFTER", "")
+HEDGE_MIN_SAMPLES = 20
+gemini_latencies = deque(maxlen=500)
+
+# Epoch time by which the current message's reply must be ready. Set per
+# message from the "deadline" in the envelope; None means no deadline.
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+# Per-connection limits for concurrent message processing
+MAX_CONCURRENT_MESSAGES = int(os.getenv("MAX_CONCURRENT_MESSAGES", 64))
+MAX_QUEUED_MESSAGES = int(os.getenv("MAX_QUEUED_MESSAGES", 1000))
+
+# Admission control shared by all connections: token buckets per number and
+# overall, and a cap on admitted messages still queued or running. Messages
+# over a limit get a canned reply instead of a Gemini call.
+admission = AdmissionController(
+    number_rate=float(os.getenv("RATE_LIMIT_PER_NUMBER", 0.5)),
+    number_burst=int(os.getenv("RATE_LIMIT_PER_NUMBER_BURST", 5)),
+    global_rate=float(os.getenv("RATE_LIMIT_GLOBAL", 50)),
+    global_burst=int(os.getenv("RATE_LIMIT_GLOBAL_BURST", 200)),
+    max_pending=int(os.getenv("ADMISSION_MAX_PENDING", 500)),
 )
+GENERATION_ERROR_MESSAGE = "Namaste! I apologize for the technical difficulty. Could you please repeat your question or maybe call our helpdesk at +91 88888-55555? I'd be happy to assist you further."
+BUSY_MESSAGE = "We're receiving a lot of messages right now. Please try again in a moment."
+SLOW_DOWN_MESSAGE = "You're sending messages faster than we can answer. Please wait a moment before sending more."
+
+# Templated replies for office, UTR and receipt questions we can answer from
+# our own records. Replies below the confidence threshold go to Gemini.
+ENABLE_FAST_PATH = os.getenv("ENABLE_FAST_PATH", "0") == "1"
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", 0.8))
 
 # Expanded dummy donation data with more realistic information
 DUMMY_DONATIONS = {
@@ -61,209 +137,347 @@ DONOR_EMAILS = {
     6: "arvin.kumar@example.com"
 }
 
-# Keep track of conversation history for each user
-user_chat_histories = {}
+# Conversation history and recent replies. HISTORY_BACKEND=sqlite keeps them in
+# a shared database file so they survive restarts and can serve several workers.
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", 20))
+storage = create_storage(
+    os.getenv("HISTORY_BACKEND", "memory"),
+    path=os.getenv("HISTORY_DB_PATH", "conversations.db"),
+    max_turns=HISTORY_MAX_TURNS,
+    idle_ttl=int(os.getenv("HISTORY_IDLE_TTL", 24 * 3600)),
+    max_entries=int(os.getenv("HISTORY_MAX_USERS", 10000)),
+    max_responses=int(os.getenv("REPLY_CACHE_SIZE", 1000)),
+    response_ttl=int(os.getenv("REPLY_CACHE_TTL", 600))
+)
+
+# Continuation prompts are kept within PROMPT_TOKEN_BUDGET input tokens. The
+# last HISTORY_RECENT_TURNS turns that fit go verbatim; older turns are folded
+# into a rolling summary in the background, HISTORY_FOLD_TURNS at a time
+# (HISTORY_SUMMARY=0 just drops them).
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 3000))
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", 6))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", 300))
+HISTORY_FOLD_TURNS = int(os.getenv("HISTORY_FOLD_TURNS", 4))
+ENABLE_HISTORY_SUMMARY = os.getenv("HISTORY_SUMMARY", "1") == "1"
+
+# Replies currently being generated, by cache key, so duplicates arriving
+# meanwhile (Twilio retries, double taps) wait for the same result
+in_flight_replies = {}
+
+
+class GenerationError(Exception):
+    """Gemini could not produce a reply; the donor gets an apology instead."""
+
+# Indexed view of the donor tables above, built once at startup
+donor_repository = DonorRepository.from_tables(DUMMY_DONATIONS, DONOR_PHONE_NUMBERS, DONOR_EMAILS)
 
 OFFICE_HOURS = "Monday to Saturday, 10:00 AM to 6:00 PM"
 CURRENT_CAMPAIGNS = ["Education Fund", "Healthcare Initiative", "Clean Water Project", "Summer Relief 2025"]
+OFFICE_ADDRESS = "Narayan Shiva Sansthan, 123 Charity Lane, Saket, New Delhi - 110017"
+HELPDESK_NUMBER = "+91 88888-55555"
+RECEIPTS_EMAIL = "receipts@narayanss.org"
 
-def identify_intent(query):
-    query_lower = query.lower()
-
-    # More detailed intent identification
-    if any(word in query_lower for word in ["donate", "contribution", "give", "support", "contribute", "payment"]):
-        return "donation_intent"
-    elif any(word in query_lower for word in ["receipt", "tax", "acknowledgment", "certificate", "80g"]) and any(word in query_lower for word in ["didn't get", "haven't received", "missing", "where", "not received"]):
-        return "receipt_issue"
-    elif any(word in query_lower for word in ["utr", "transaction", "payment", "confirm", "successful", "went through"]):
-        return "utr_verification"
-    elif any(word in query_lower for word in ["volunteer", "volunteering", "help out", "join", "participate"]):
-        return "volunteer_inquiry"
-    elif any(word in query_lower for word in ["tax benefit", "80g", "deduction", "tax exemption"]):
-        return "tax_benefit_inquiry"
-    elif any(word in query_lower for word in ["project", "campaign", "initiative", "program", "what do you do"]):
-        return "project_inquiry"
-    elif any(word in query_lower for word in ["office", "location", "address", "visit", "come to"]):
-        return "office_inquiry"
-    else:
-        return "general_inquiry"
-
-def extract_info_from_query(query):
-    # Extract UTR if mentioned
-    utr_match = re.search(r'UTR\d+', query, re.IGNORECASE)
-    utr = utr_match.group(0) if utr_match else None
-
-    # Extract amount if mentioned
-    amount_match = re.search(r'₹\s*(\d+)', query) or re.search(r'Rs\.?\s*(\d+)', query) or re.search(r'(\d+)\s*rupees', query, re.IGNORECASE)
-    amount = amount_match.group(1) if amount_match else None
-
-    # Extract phone number if mentioned
-    phone_match = re.search(r'(\+91\s?)?[789]\d{9}', query) or re.search(r'(\+91\s?)?[789]\d\d\d\d\s?\d\d\d\d\d', query)
-    phone = phone_match.group(0) if phone_match else None
-
-    # Extract name if mentioned (simple version)
-    name_indicators = ["name is", "this is", "called", "speaking", "named", "by the name"]
-    name = None
-    for indicator in name_indicators:
-        if indicator in query.lower():
-            parts = query.lower().split(indicator)
-            if len(parts) > 1:
-                potential_name = parts[1].strip().split()[0].capitalize()
-                if len(potential_name) > 2:  # Avoid picking up small words
-                    name = potential_name
-                    break
-
-    # Check for specific names in the text
-    common_names = ["Arvin", "Rajesh", "Priya", "Amit", "Sneha"]
-    for common_name in common_names:
-        if common_name.lower() in query.lower():
-            name = common_name
-            break
-
-    return {"utr": utr, "amount": amount, "phone": phone, "name": name}
+# Rendered donor blocks for the prompt, re-rendered only when a record changes
+donor_context = DonorContextRenderer(donor_repository, max_tokens=int(os.getenv("DONOR_CONTEXT_MAX_TOKENS", 600)))
 
-def get_user_id_from_info(extracted_info, phone_number=None):
-    # Clean the phone number format to match our stored formats
-    clean_phone = None
-    if phone_number:
-        # Remove any 'whatsapp:' prefix
-        if phone_number.startswith("whatsapp:"):
-            phone_number = phone_number[9:]
+fast_path = FastPathResponder(donor_repository, OFFICE_ADDRESS, OFFICE_HOURS, HELPDESK_NUMBER, RECEIPTS_EMAIL)
 
-        # Try to standardize phone format
-        clean_phone = re.sub(r'\s+', '', phone_number)
+def identify_intent(query):
+    return analyze_message(query)["intent"]
 
+def extract_info_from_query(query):
+    info = analyze_message(query)
+    return {"utr": info["utr"], "amount": info["amount"], "phone": info["phone"], "name": info["name"]}
+
+def resolve_donor(extracted_info, phone_number=None):
+    """
+    Return (user_id, matched_by). matched_by is "phone", "utr", "name",
+    "mentioned_phone" or "guess", so callers can tell a record lookup from
+    the fallback below.
+    """
     # Try to match by phone number first
-    if clean_phone:
-        for id, phone in DONOR_PHONE_NUMBERS.items():
-            if clean_phone in phone.replace(" ", ""):
-                return id
+    if phone_number:
+        user_id = donor_repository.find_by_phone(phone_number)
+        if user_id is not None:
+            return user_id, "phone"
 
     # Determine user ID from extracted information
     if extracted_info["utr"]:
-        for id, donations in DUMMY_DONATIONS.items():
-            if any(d.get("utr", "") == extracted_info["utr"] for d in donations):
-                return id
+        user_id = donor_repository.find_by_utr(extracted_info["utr"])
+        if user_id is not None:
+            return user_id, "utr"
 
     # If no UTR match, try to match by name
     if extracted_info["name"]:
-        for id, donations in DUMMY_DONATIONS.items():
-            if donations and any(extracted_info["name"].lower() in d.get("donor_name", "").lower() for d in donations):
-                return id
+        user_id = donor_repository.find_by_name(extracted_info["name"])
+        if user_id is not None:
+            return user_id, "name"
 
     # Check if the extracted phone number corresponds to any donor
     if extracted_info["phone"]:
-        for id, phone in DONOR_PHONE_NUMBERS.items():
-            if extracted_info["phone"] in phone.replace(" ", ""):
-                return id
+        user_id = donor_repository.find_by_phone(extracted_info["phone"])
+        if user_id is not None:
+            return user_id, "mentioned_phone"
 
     # Special case for Arvin
     if extracted_info["name"] == "Arvin" or (extracted_info["phone"] and "97800" in extracted_info["phone"]):
-        return 6
+        return 6, "name"
 
     # Default to user 1 or a random user
-    return random.choice([1, 2, 3, 4])
+    return random.choice([1, 2, 3, 4]), "guess"
+
+def get_user_id_from_info(extracted_info, phone_number=None):
+    return resolve_donor(extracted_info, phone_number)[0]
+
+_time_context = (None, None)
+
+def get_time_context():
+    """Current date/time, office hours and campaigns, rebuilt once a minute."""
+    global _time_context
+    now = datetime.now()
+    minute = now.replace(second=0, microsecond=0)
+    if _time_context[0] != minute:
+        current_datetime = now.strftime("%Y-%m-%d, %A, %H:%M")
+        _time_context = (minute, f"\nCurrent Date and Time: {current_datetime}\nOffice Hours: {OFFICE_HOURS}\nActive Campaigns: {', '.join(CURRENT_CAMPAIGNS)}\n")
+    return _time_context[1]
+
+async def summarize_conversation(previous_summary, messages, max_tokens):
+    """Fold older turns into the running summary of a conversation."""
+    transcript = "\n".join(
+        f"{'Ananya' if m.get('role') == 'assistant' else 'Donor'}: {m.get('content', '')}" for m in messages
+    )
+    prompt = f"""Update the summary of a WhatsApp conversation between a donor and Ananya, the receptionist at Narayan Shiva Sansthan.
+Keep names, amounts, dates, UTR numbers, open questions and anything Ananya promised. Write plain prose in under {max_tokens * 3 // 4} words.
+
+Summary so far:
+{previous_summary or "(none)"}
+
+Earlier messages to add:
+{transcript}
+"""
+    generate_config = types.GenerateContentConfig(temperature=0.2, max_output_tokens=max_tokens)
+    # Runs in the background, after the reply that triggered it has gone out
+    current_deadline.set(None)
+    response = await generate_content(GEMINI_MODEL, [prompt], generate_config)
+    return response.text
+
+history_manager = HistoryManager(
+    storage,
+    summarize_conversation if ENABLE_HISTORY_SUMMARY else None,
+    recent_turns=HISTORY_RECENT_TURNS,
+    summary_tokens=HISTORY_SUMMARY_TOKENS,
+    fold_turns=HISTORY_FOLD_TURNS,
+    max_turns=HISTORY_MAX_TURNS,
+)
+
+def build_history_contents(history):
+    """
+    Convert stored chat history into Gemini Content turns.
+    Our "assistant" role maps to Gemini's "model" role.
+    """
+    contents = []
+    for msg in history:
+        role = "model" if msg.get("role") == "assistant" else "user"
+        contents.append(types.Content(role=role, parts=[types.Part(text=msg.get("content", ""))]))
+    return contents
+
+def time_left():
+    """Seconds until the current message's deadline, or None without one."""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.time()
+
+def is_retryable(error):
+    # httpx is what the genai client uses underneath for transport
+    if isinstance(error, (asyncio.TimeoutError, OSError, httpx.TransportError)):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS_CODES
+
+def hedge_delay():
+    """Seconds to wait before hedging a Gemini call, or None not to hedge."""
+    if not GEMINI_HEDGE_AFTER:
+        return None
+    if GEMINI_HEDGE_AFTER != "auto":
+        return float(GEMINI_HEDGE_AFTER)
+    if len(gemini_latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(gemini_latencies)
+    return ordered[int(len(ordered) * 0.95)]
+
+async def generate_content(model, contents, config=None):
+    """
+    Call Gemini through the async client so the event loop keeps serving
+    other donors while we wait. The semaphore caps in-flight requests.
+
+    Each attempt is bounded by GEMINI_TIMEOUT and by the message deadline;
+    retryable failures are retried with backoff while time remains.
+    """
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        remaining = time_left()
+        if remaining is not None and remaining <= 0:
+            metrics.inc("gemini_requests_total", outcome="deadline")
+            raise asyncio.TimeoutError("Message deadline passed before Gemini answered")
+        timeout = GEMINI_TIMEOUT if remaining is None else min(GEMINI_TIMEOUT, remaining)
+
+        try:
+            response = await asyncio.wait_for(hedged_call(model, contents, config), timeout=timeout)
+        except Exception as e:
+            metrics.inc("gemini_requests_total", outcome="error")
+            if attempt == GEMINI_MAX_RETRIES or not is_retryable(e):
+                raise
+            backoff = GEMINI_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.0)
+            remaining = time_left()
+            if remaining is not None and remaining <= backoff:
+                raise
+            print(f"Gemini call failed ({e}), retrying in {backoff:.2f}s")
+            metrics.inc("gemini_retries_total")
+            await asyncio.sleep(backoff)
+            continue
+
+        metrics.inc("gemini_requests_total", outcome="ok")
+        record_token_usage(getattr(response, "usage_metadata", None))
+        return response
+
+async def hedged_call(model, contents, config):
+    """
+    One Gemini attempt, hedged with a second identical request if the first
+    is slower than hedge_delay(). The first successful answer is returned
+    and the other request is cancelled.
+    """
+    delay = hedge_delay()
+    primary = asyncio.ensure_future(call_gemini(model, contents, config))
+    if delay is None:
+        return await primary
+
+    calls = [primary]
+    try:
+        done, _ = await asyncio.wait(calls, timeout=delay)
+        if not done:
+            calls.append(asyncio.ensure_future(call_gemini(model, contents, config)))
+            metrics.inc("gemini_hedges_total")
+        while True:
+            done, _ = await asyncio.wait(calls, return_when=asyncio.FIRST_COMPLETED)
+            for call in done:
+                calls.remove(call)
+                if call.exception() is None or not calls:
+                    if call is not primary and call.exception() is None:
+                        metrics.inc("gemini_hedge_wins_total")
+                    return call.result()
+    finally:
+        for call in calls:
+            call.cancel()
+
+async def call_gemini(model, contents, config):
+    with metrics.span("llm_wait"):
+        await llm_semaphore.acquire()
+    try:
+        started = time.monotonic()
+        with metrics.span("gemini"):
+            response = await client.aio.models.generate_content(
+                model=model,
+                contents=contents,
+                config=config
+            )
+        gemini_latencies.append(time.monotonic() - started)
+        return response
+    finally:
+        llm_semaphore.release()
+
+def record_token_usage(usage):
+    if usage is None:
+        return
+    for kind, count in (
+        ("prompt", usage.prompt_token_count),
+        ("cached", usage.cached_content_token_count),
+        ("output", usage.candidates_token_count),
+    ):
+        if count:
+            metrics.inc("gemini_tokens_total", count, kind=kind)
 
 async def generate_response(query, phone_number):
-    model = "gemini-2.0-flash"
+    """Return the reply text for a message. Raises GenerationError if Gemini fails."""
+    model = GEMINI_MODEL
 
-    # Extract information and identify intent
-    extracted_info = extract_info_from_query(query)
-    intent = identify_intent(query)
+    # Extract information and identify intent in a single pass
+    with metrics.span("intent"):
+        extracted_info = analyze_message(query)
+    intent = extracted_info["intent"]
 
     # Determine user ID
-    user_id = get_user_id_from_info(extracted_info, phone_number)
+    with metrics.span("donor_lookup"):
+        user_id, matched_by = resolve_donor(extracted_info, phone_number)
+
+    if ENABLE_FAST_PATH:
+        with metrics.span("fast_path"):
+            result = fast_path.respond(intent, extracted_info, user_id, matched_by, query)
+        if result and result[1] >= FAST_PATH_MIN_CONFIDENCE:
+            metrics.inc("replies_total", intent=intent, path="fast")
+            await storage.append_turn(phone_number, query, result[0])
+            return result[0]
+    metrics.inc("replies_total", intent=intent, path="llm")
 
     # Build user context with detailed information
-    if user_id in DUMMY_DONATIONS and DUMMY_DONATIONS[user_id]:
-        user_context = f"\nDonor Information:\nName: {DUMMY_DONATIONS[user_id][0].get('donor_name')}\nPhone: {DONOR_PHONE_NUMBERS.get(user_id)}\nEmail: {DONOR_EMAILS.get(user_id)}\n\nDonation History:\n"
-        for d in DUMMY_DONATIONS[user_id]:
-            receipt_status = "Sent on " + (datetime.strptime(d.get('date'), "%Y-%m-%d") + timedelta(days=2)).strftime("%Y-%m-%d") if d.get("receipt_sent") else "Pending - Will be sent within 24 hours"
-            user_context += f"- ₹{d.get('amount')} on {d.get('date')} for {d.get('campaign')}, via {d.get('payment_method')}, UTR: {d.get('utr')}, Receipt Status: {receipt_status}\n"
-    else:
-        user_context = "\nThis appears to be a new donor with no previous donation history in our system.\n"
+    with metrics.span("prompt_build"):
+        user_context = donor_context.render(user_id)
 
-    # Add current date and time context
-    current_datetime = datetime.now().strftime("%Y-%m-%d, %A, %H:%M")
-    time_context = f"\nCurrent Date and Time: {current_datetime}\nOffice Hours: {OFFICE_HOURS}\nActive Campaigns: {', '.join(CURRENT_CAMPAIGNS)}\n"
+        # Add current date and time context
+        time_context = get_time_context()
 
     # Get chat history for this user
-    history = user_chat_histories.get(phone_number, [])
+    with metrics.span("history_load"):
+        history = await storage.get_history(phone_number)
 
     # Initial message handling
     if not history:
-        system_instruction = f"""You are Ananya, a friendly and helpful receptionist at Narayan Shiva Sansthan, a charitable organization.
-Your role is to assist donors, potential donors, and anyone with inquiries about the foundation.
-Always be warm, personable, and speak as if you're sitting at the front desk of our charity office.
-
-Use Indian expressions and references where appropriate. Address people respectfully, using "ji" occasionally.
-If the conversation is in Hindi or any regional language, respond accordingly.
-
-Current information:
+        dynamic_context = f"""Current information:
 {time_context}
 
 Donor information:
 {user_context}
-
-Foundation information:
-{LONG_CONTEXT}
-
-When greeting callers:
-- Use phrases like "Namaste", "Good morning/afternoon", or "Welcome to Narayan Shiva Sansthan"
-- Introduce yourself as Ananya from the reception desk
-- Thank donors for their support and generosity
-
-IMPORTANT: Never include any "acting" or roleplay elements in your responses. Do not include phrases like "(slight pause)" or descriptions of your actions. Simply respond as if you're having a natural conversation.
-
-IMPORTANT FOR WHATSAPP: Keep your responses concise and to the point, suitable for WhatsApp messages. Avoid very long explanations.
-
-Guidelines based on inquiry type:
-1. For donation intents - Express gratitude, provide donation options, and the donation link (https://donate.narayanss.org)
-2. For receipt issues - Check the donation history, apologize for any delays, and offer to expedite
-3. For UTR verifications - Confirm transactions from the donation history if available
-4. For volunteer inquiries - Share volunteer opportunities and ask for their areas of interest
-5. For tax benefit inquiries - Explain Section 80G benefits clearly and what documentation we provide
-6. For office inquiries - Share our address and invite them to visit during office hours
-7. For project inquiries - Describe our current initiatives with enthusiasm and share success stories
-
-Important notes:
-- Be compassionate and patient, especially with donation-related concerns
-- If you don't have certain information, offer to connect them with the appropriate team member
-- Always express gratitude for their interest in our foundation
-- End conversations warmly and ask if there's anything else you can assist with
-- Your responses should be concise and professional
-
-Remember, you're the friendly face of Narayan Shiva Sansthan Foundation!
 """
 
-        generate_config = types.GenerateContentConfig(
-            system_instruction=system_instruction,
-            temperature=0.7,  # Slightly higher temperature for more personable responses
-            max_output_tokens=1000,  # Keep responses shorter for WhatsApp
-        )
-
-        contents = [query]
-
         try:
-            response = client.models.generate_content(
-                model=model,
-                contents=contents,
-                config=generate_config
-            )
+            with metrics.span("prompt_cache"):
+                cache_name = await prompt_cache.get_name() if ENABLE_CONTEXT_CACHE else None
+            response = None
+            if cache_name:
+                # Static persona and foundation details come from the cache; only
+                # the per-donor context travels with the request
+                generate_config = types.GenerateContentConfig(
+                    cached_content=cache_name,
+                    temperature=0.7,
+                    max_output_tokens=1000,
+                )
+                contents = [types.Content(role="user", parts=[
+                    types.Part(text=dynamic_context),
+                    types.Part(text=query),
+                ])]
+                try:
+                    response = await generate_content(model, contents, generate_config)
+                except Exception as e:
+                    # Only a missing cache is worth resending the full prompt for;
+                    # overloads and timeouts go to the usual fallback
+                    if not cache_is_missing(e):
+                        raise
+                    print(f"Cached prompt no longer exists, sending full prompt: {e}")
+                    prompt_cache.invalidate()
+
+            if response is None:
+                generate_config = types.GenerateContentConfig(
+                    system_instruction=STATIC_SYSTEM_INSTRUCTION + "\n" + dynamic_context,
+                    temperature=0.7,  # Slightly higher temperature for more personable responses
+                    max_output_tokens=1000,  # Keep responses shorter for WhatsApp
+                )
+                response = await generate_content(model, [query], generate_config)
 
             full_response = response.text
 
             # Update chat history
-            user_chat_histories[phone_number] = [
-                {"role": "user", "content": query},
-                {"role": "assistant", "content": full_response}
-            ]
+            await storage.append_turn(phone_number, query, full_response)
 
             return full_response
 
         except Exception as e:
-            print(f"Error generating response: {e}")
-            return "Namaste! I apologize for the technical difficulty. Could you please repeat your question or maybe call our helpdesk at +91 88888-55555? I'd be happy to assist you further."
+            raise GenerationError(e) from e
 
     else:
         # Continuation from chat history with updated context
@@ -284,40 +498,34 @@ IMPORTANT FOR WHATSAPP: Keep your responses concise and to the point, suitable f
 Remember to be warm, personable, and helpful while maintaining the professional tone of a charity organization.
 """
 
-            # Initialize the chat
-            chat = client.chats.create(model=model)
-
-            # Add the system instruction using a system message format
-            chat.send_message(system_content)
+            # Fit summary and recent turns into what is left of the budget
+            history_budget = PROMPT_TOKEN_BUDGET - estimate_tokens(system_content) - estimate_tokens(query)
+            with metrics.span("history_select"):
+                summary, history = await history_manager.select(phone_number, history, history_budget)
+            if summary:
+                system_content += f"\nSummary of the earlier conversation:\n{summary}\n"
+
+            generate_config = types.GenerateContentConfig(
+                system_instruction=system_content,
+                temperature=0.7,
+                max_output_tokens=1000,
+            )
 
-            # Add the conversation history (up to the last 5 exchanges to keep context manageable)
-            for msg in history[-10:]:  # Limit to last 5 exchanges (10 messages)
-                if msg.get("role") == "user":
-                    chat.send_message(msg.get("content", ""))
-                elif msg.get("role") == "assistant":
-                    # We don't send assistant messages back to the model
-                    pass
+            # Replay the recent conversation as structured turns so the whole
+            # context goes to Gemini in a single request
+            contents = build_history_contents(history)
+            contents.append(types.Content(role="user", parts=[types.Part(text=query)]))
 
-            # Send the current query
-            response = chat.send_message(query)
+            response = await generate_content(model, contents, generate_config)
             full_response = response.text
 
             # Update the chat history
-            updated_history = history.copy()
-            updated_history.append({"role": "user", "content": query})
-            updated_history.append({"role": "assistant", "content": full_response})
-
-            # Store the updated history
-            user_chat_histories[phone_number] = updated_history
+            await storage.append_turn(phone_number, query, full_response)
 
             return full_response
 
         except Exception as e:
-            print(f"Error generating response: {e}")
-            return "Namaste! I apologize for the technical difficulty. Could you please repeat your question or maybe call our helpdesk at +91 88888-55555? I'd be happy to assist you further."
-
-# Dictionary to store last responses
-last_response_cache = {}
+            raise GenerationError(e) from e
 
 # Function to format WhatsApp response
 def format_whatsapp_response(message_body):
@@ -325,51 +533,168 @@ def format_whatsapp_response(message_body):
     response.message(message_body)
     return str(response)
 
-# WebSocket handler
-async def handle_whatsapp_message(websocket, path):
-    async for message in websocket:
+async def send_reply(websocket, whatsapp_response, request_id=None):
+    """
+    Send a TwiML reply. Clients that tag requests with an "id" (such as the
+    connector's connection pool) get it echoed back in a JSON envelope so
+    they can match replies to requests on a shared connection.
+    """
+    if request_id is None:
+        await websocket.send(whatsapp_response)
+    else:
+        await websocket.send(json.dumps({"id": request_id, "Body": whatsapp_response}))
+
+async def process_message(phone_number, message_body):
+    """
+    Generate the TwiML reply for one incoming WhatsApp message. Identical
+    messages from the same number share one generation while it runs, and
+    the generation is cancelled once every caller waiting on it has gone.
+    """
+    cache_key = f"{phone_number}:{message_body}"
+    pending = in_flight_replies.get(cache_key)
+    if pending is None:
+        task = asyncio.ensure_future(build_reply(phone_number, message_body, cache_key))
+        pending = in_flight_replies[cache_key] = {"task": task, "waiters": 0}
+
+        def forget(done):
+            if in_flight_replies.get(cache_key) is pending:
+                del in_flight_replies[cache_key]
+        task.add_done_callback(forget)
+    else:
+        metrics.inc("dedup_hits_total", source="in_flight")
+
+    # Shielded so one caller going away doesn't cancel the others' reply
+    pending["waiters"] += 1
+    try:
+        return await asyncio.shield(pending["task"])
+    finally:
+        pending["waiters"] -= 1
+        if pending["waiters"] == 0 and not pending["task"].done():
+            # Forget it now, so a duplicate arriving before the task has
+            # finished cancelling starts a fresh generation instead of joining
+            if in_flight_replies.get(cache_key) is pending:
+                del in_flight_replies[cache_key]
+            pending["task"].cancel()
+            metrics.inc("generations_cancelled_total")
+
+async def build_reply(phone_number, message_body, cache_key):
+    try:
+        # Check if we've already processed this exact message recently (to avoid duplicates)
+        cached_response = await storage.get_cached_response(cache_key)
+        if cached_response is not None:
+            metrics.inc("dedup_hits_total", source="cache")
+            return cached_response
+
+        # Generate response
         try:
-            data = json.loads(message)
-            phone_number = data.get('From')
-            message_body = data.get('Body')
-
-            print(f"Received message from {phone_number}: {message_body}")
-
-            if not phone_number or not message_body:
-                error_message = format_whatsapp_response("Error: Phone number and message are required.")
-                await websocket.send(error_message)
-                continue
-
-            # Check if we've already processed this exact message recently (to avoid duplicates)
-            cache_key = f"{phone_number}:{message_body}"
-            if cache_key in last_response_cache:
-                await websocket.send(last_response_cache[cache_key])
-                continue
-
-            # Generate response
             response_text = await generate_response(message_body, phone_number)
+        except GenerationError as e:
+            # Not cached, so the donor repeating the message gets a fresh try
+            print(f"Error generating response: {e}")
+            metrics.inc("fallback_replies_total", reason="generation_error")
+            return format_whatsapp_response(GENERATION_ERROR_MESSAGE)
 
-            # Format for WhatsApp
+        # Format for WhatsApp
+        with metrics.span("format"):
             whatsapp_response = format_whatsapp_response(response_text)
 
-            # Store in cache
-            last_response_cache[cache_key] = whatsapp_response
+        # Store in cache
+        await storage.cache_response(cache_key, whatsapp_response)
 
-            # Clean up cache (keep only last 100 responses)
-            if len(last_response_cache) > 100:
-                # Remove oldest item
-                last_response_cache.pop(next(iter(last_response_cache)))
+        return whatsapp_response
 
-            # Send response
-            await websocket.send(whatsapp_response)
+    except Exception as e:
+        print(f"Error processing message: {e}")
+        metrics.inc("fallback_replies_total", reason="processing_error")
+        return format_whatsapp_response("Sorry, there was an error processing your message.")
 
-        except json.JSONDecodeError:
-            error_message = format_whatsapp_response("Error: Invalid JSON format.")
-            await websocket.send(error_message)
-        except Exception as e:
-            print(f"Error processing message: {e}")
-            error_message = format_whatsapp_response("Sorry, there was an error processing your message.")
-            await websocket.send(error_message)
+def shed_reply(phone_number, reason):
+    """
+    TwiML for a message refused by admission control. Each number gets the
+    canned text at most once a minute; further messages get no reply.
+    """
+    metrics.inc("fallback_replies_total", reason=reason)
+    if not admission.should_notify(phone_number):
+        return str(MessagingResponse())
+    return format_whatsapp_response(SLOW_DOWN_MESSAGE if reason == NUMBER_RATE else BUSY_MESSAGE)
+
+# WebSocket handler
+async def handle_whatsapp_message(websocket, path=None):
+    async def reply(whatsapp_response, request_id):
+        await send_reply(websocket, whatsapp_response, request_id)
+
+    async def process(data):
+        # The sender stops waiting at its deadline, so don't work past it
+        deadline = data.get('deadline')
+        if deadline is None:
+            with metrics.span("handle_message"):
+                return await process_message(data.get('From'), data.get('Body'))
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            metrics.inc("deadline_exceeded_total", stage="queued")
+            return None
+        current_deadline.set(deadline)
+        try:
+            with metrics.span("handle_message"):
+                return await asyncio.wait_for(process_message(data.get('From'), data.get('Body')), timeout=remaining)
+        except asyncio.TimeoutError:
+            metrics.inc("deadline_exceeded_total", stage="processing")
+            return None
+
+    dispatcher = MessageDispatcher(
+        process,
+        reply,
+        max_concurrent=MAX_CONCURRENT_MESSAGES,
+        max_queued=MAX_QUEUED_MESSAGES,
+        on_done=lambda data: admission.release()
+    )
+
+    try:
+        async for message in websocket:
+            request_id = None
+            try:
+                data = json.loads(message)
+                request_id = data.get('id')
+                if data.get('cancel'):
+                    # The sender gave up on this request; stop working on it
+                    dispatcher.cancel(request_id)
+                    continue
+
+                phone_number = data.get('From')
+                message_body = data.get('Body')
+
+                print(f"Received message from {phone_number}: {message_body}")
+
+                if not phone_number or not message_body:
+                    error_message = format_whatsapp_response("Error: Phone number and message are required.")
+                    await send_reply(websocket, error_message, request_id)
+                    continue
+
+                decision = admission.admit(phone_number)
+                if decision != ADMITTED:
+                    await send_reply(websocket, shed_reply(phone_number, decision), request_id)
+                    continue
+
+                # Messages from different numbers run concurrently; each number
+                # keeps its own order. Clients that don't tag requests with an id
+                # match replies by order, so their messages share a single lane.
+                lane = phone_number if request_id is not None else None
+                if not dispatcher.submit(lane, request_id, data):
+                    admission.release()
+                    metrics.inc("fallback_replies_total", reason="busy")
+                    busy_message = format_whatsapp_response(BUSY_MESSAGE)
+                    await send_reply(websocket, busy_message, request_id)
+
+            except json.JSONDecodeError:
+                error_message = format_whatsapp_response("Error: Invalid JSON format.")
+                await send_reply(websocket, error_message, request_id)
+            except Exception as e:
+                print(f"Error processing message: {e}")
+                error_message = format_whatsapp_response("Sorry, there was an error processing your message.")
+                await send_reply(websocket, error_message, request_id)
+    finally:
+        await dispatcher.close()
 
 # LONG_CONTEXT definition (shortened for brevity - replace with the full context from your code)
 LONG_CONTEXT = """
@@ -421,16 +746,98 @@ Narayan Shiva Sansthan
 New Delhi - 110017
 """
 
+# Invariant part of the first-contact prompt. Registered once as Gemini cached
+# content when it reaches CONTEXT_CACHE_MIN_TOKENS (at about 1.1k tokens it
+# is still sent inline); the per-donor and time context goes with each request.
+STATIC_SYSTEM_INSTRUCTION = f"""You are Ananya, a friendly and helpful receptionist at Narayan Shiva Sansthan, a charitable organization.
+Your role is to assist donors, potential donors, and anyone with inquiries about the foundation.
+Always be warm, personable, and speak as if you're sitting at the front desk of our charity office.
+
+Use Indian expressions and references where appropriate. Address people respectfully, using "ji" occasionally.
+If the conversation is in Hindi or any regional language, respond accordingly.
+
+Foundation information:
+{LONG_CONTEXT}
+
+When greeting callers:
+- Use phrases like "Namaste", "Good morning/afternoon", or "Welcome to Narayan Shiva Sansthan"
+- Introduce yourself as Ananya from the reception desk
+- Thank donors for their support and generosity
+
+IMPORTANT: Never include any "acting" or roleplay elements in your responses. Do not include phrases like "(slight pause)" or descriptions of your actions. Simply respond as if you're having a natural conversation.
+
+IMPORTANT FOR WHATSAPP: Keep your responses concise and to the point, suitable for WhatsApp messages. Avoid very long explanations.
+
+Guidelines based on inquiry type:
+1. For donation intents - Express gratitude, provide donation options, and the donation link (https://donate.narayanss.org)
+2. For receipt issues - Check the donation history, apologize for any delays, and offer to expedite
+3. For UTR verifications - Confirm transactions from the donation history if available
+4. For volunteer inquiries - Share volunteer opportunities and ask for their areas of interest
+5. For tax benefit inquiries - Explain Section 80G benefits clearly and what documentation we provide
+6. For office inquiries - Share our address and invite them to visit during office hours
+7. For project inquiries - Describe our current initiatives with enthusiasm and share success stories
+
+Important notes:
+- Be compassionate and patient, especially with donation-related concerns
+- If you don't have certain information, offer to connect them with the appropriate team member
+- Always express gratitude for their interest in our foundation
+- End conversations warmly and ask if there's anything else you can assist with
+- Your responses should be concise and professional
+
+Remember, you're the friendly face of Narayan Shiva Sansthan Foundation!
+
+The current date, office hours, active campaigns and the donor's record are provided at the start of each conversation.
+"""
+
+prompt_cache = PromptCache(client, GEMINI_MODEL, STATIC_SYSTEM_INSTRUCTION, ttl_seconds=CONTEXT_CACHE_TTL,
+                           min_tokens=CONTEXT_CACHE_MIN_TOKENS)
+
+def collect_component_stats():
+    """Export the counters the prompt cache and history store already keep."""
+    for event, count in prompt_cache.stats().items():
+        yield "prompt_cache_events_total", "counter", {"event": event}, count
+    for decision, count in admission.stats().items():
+        if decision == "pending":
+            yield "admission_pending", "gauge", {}, count
+        else:
+            yield "admission_total", "counter", {"decision": decision}, count
+    for event, count in donor_context.stats().items():
+        if event != "entries":
+            yield "donor_context_cache_total", "counter", {"event": event}, count
+    conversations = getattr(storage, "conversations", None)
+    if conversations is not None:
+        for key, value in conversations.stats().items():
+            if key == "conversations":
+                yield "history_conversations", "gauge", {}, value
+            else:
+                yield "history_events_total", "counter", {"event": key}, value
+
+metrics.register_collector(collect_component_stats)
+
+def serve_metrics(connection, request):
+    """Answer plain HTTP GET /metrics on the WebSocket port; other paths upgrade as usual."""
+    if request.path == "/metrics":
+        return connection.respond(HTTPStatus.OK, metrics.render())
+    return None
+
 # Main function to start the WebSocket server
 async def main():
+    # supervisor.py runs several of these on private ports behind one router
+    host = os.getenv("WEBSOCKET_HOST", "0.0.0.0")  # Listen on all available interfaces
+    port = int(os.getenv("WEBSOCKET_PORT", 8765))
     print("Starting WhatsApp WebSocket server...")
     server = await websockets.serve(
         handle_whatsapp_message,
-        "0.0.0.0",  # Listen on all available interfaces
-        8765  # WebSocket port
+        host,
+        port,
+        process_request=serve_metrics
     )
-    print("WebSocket server running on ws://0.0.0.0:8765")
-    await server.wait_closed()
+    print(f"WebSocket server running on ws://{host}:{port}")
+    try:
+        await server.wait_closed()
+    finally:
+        await history_manager.close()
+        await storage.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,238 @@
+import json
+import time
+import zlib
+import uuid
+import random
+import asyncio
+import threading
+import websockets
+
+
+class _PooledConnection:
+    """
+    One persistent WebSocket to the bot server. Replies are matched to
+    requests by the "id" field echoed back in the JSON envelope, so any
+    number of requests can be in flight on the same socket.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.websocket = None
+        self.pending = {}
+        self.connected = asyncio.Event()
+
+    async def run(self):
+        """Keep the connection open, reconnecting with jittered exponential backoff."""
+        backoff = self.pool.min_backoff
+        while not self.pool.closed:
+            try:
+                async with websockets.connect(self.pool.url) as websocket:
+                    self.websocket = websocket
+                    self.connected.set()
+                    backoff = self.pool.min_backoff
+                    async for raw in websocket:
+                        self._dispatch(raw)
+            except Exception as e:
+                print(f"WebSocket pool connection error: {e}")
+            finally:
+                self.websocket = None
+                self.connected.clear()
+                self._fail_pending()
+
+            if self.pool.closed:
+                break
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.0))
+            backoff = min(backoff * 2, self.pool.max_backoff)
+
+    def _dispatch(self, raw):
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            print("WebSocket pool received a reply without an envelope")
+            return
+        future = self.pending.pop(data.get("id"), None)
+        if future and not future.done():
+            future.set_result(data.get("Body"))
+
+    def _fail_pending(self):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("WebSocket connection lost"))
+        self.pending.clear()
+
+    async def request(self, payload, timeout):
+        """
+        Send one request and wait for its reply. The envelope carries the
+        epoch time after which we stop waiting, and on timeout (or if the
+        caller is cancelled) the server is told to cancel the request so it
+        doesn't generate a reply nobody will read.
+        """
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            await self.websocket.send(json.dumps(dict(payload, id=request_id, deadline=time.time() + timeout)))
+            return await asyncio.wait_for(future, timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            await self._cancel(request_id)
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _cancel(self, request_id):
+        websocket = self.websocket
+        if websocket is None:
+            return
+        try:
+            await websocket.send(json.dumps({"id": request_id, "cancel": True}))
+        except Exception as e:
+            print(f"Could not cancel WebSocket request: {e}")
+
+
+class WebSocketPool:
+    """
+    Long-lived pool of WebSocket connections to the bot server.
+
+    The connections live on a private event loop running in a daemon thread,
+    so synchronous Flask/gunicorn workers can share them through send().
+    The loop is started lazily on first use, which keeps it safe to create
+    the pool before gunicorn forks its workers.
+    """
+
+    def __init__(self, url, size=4, timeout=30, min_backoff=0.1, max_backoff=10):
+        self.url = url
+        self.size = size
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.closed = False
+
+        self.loop = None
+        self._thread = None
+        self._connections = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self.loop.run_forever, name="ws-pool", daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self._open_connections(), self.loop).result()
+
+    async def attach(self):
+        """
+        Open the connections on the running event loop instead of a private
+        thread, for callers that are async themselves and await request()
+        directly.
+        """
+        with self._start_lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.get_running_loop()
+        await self._open_connections()
+
+    async def _open_connections(self):
+        for _ in range(self.size):
+            connection = _PooledConnection(self)
+            self._connections.append(connection)
+            asyncio.create_task(connection.run())
+
+    async def _pick_connection(self, timeout, key=None):
+        """
+        Return the connection a hash of key (the sender's number) maps to,
+        so one donor's messages stay in order on one socket, as the bot only
+        orders them per connection. While that connection is down, or with
+        no key, use the live one with the fewest requests in flight.
+        """
+        if key and self._connections:
+            connection = self._connections[zlib.crc32(key.encode()) % len(self._connections)]
+            if connection.websocket is not None:
+                return connection
+        live = [c for c in self._connections if c.websocket is not None]
+        if not live:
+            waiters = [asyncio.create_task(c.connected.wait()) for c in self._connections]
+            try:
+                await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+            live = [c for c in self._connections if c.websocket is not None]
+            if not live:
+                raise ConnectionError("No connection to the WebSocket server")
+        return min(live, key=lambda c: len(c.pending))
+
+    def is_connected(self):
+        return any(c.websocket is not None for c in self._connections)
+
+    async def request(self, payload, timeout=None):
+        """Send a message envelope and wait for the matching reply."""
+        timeout = timeout or self.timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        connection = await self._pick_connection(timeout, payload.get("From"))
+        return await connection.request(payload, max(deadline - loop.time(), 0))
+
+    def send(self, from_number, message_body):
+        """
+        Blocking helper for synchronous callers. Returns the bot's reply, or
+        None if the server could not be reached or did not answer in time.
+        """
+        self.start()
+        payload = {"From": from_number, "Body": message_body}
+        future = asyncio.run_coroutine_threadsafe(self.request(payload), self.loop)
+        try:
+            return future.result()
+        except asyncio.TimeoutError:
+            print("WebSocket response timed out")
+        except ConnectionError as e:
+            print(f"WebSocket connection error: {e}")
+        except Exception as e:
+            print(f"WebSocket error: {e}")
+        return None
+
+    def submit(self, from_number, message_body, callback):
+        """
+        Non-blocking variant of send(). callback(reply) is called with the
+        bot's reply, or None on failure, from the pool's thread, so it
+        should hand the reply off rather than do slow work itself.
+        """
+        self.start()
+        payload = {"From": from_number, "Body": message_body}
+
+        async def _request():
+            try:
+                reply = await self.request(payload)
+            except asyncio.TimeoutError:
+                print("WebSocket response timed out")
+                reply = None
+            except Exception as e:
+                print(f"WebSocket error: {e}")
+                reply = None
+            try:
+                callback(reply)
+            except Exception as e:
+                print(f"Error in reply callback: {e}")
+
+        asyncio.run_coroutine_threadsafe(_request(), self.loop)
+
+    def close(self):
+        self.closed = True
+        if self.loop is None:
+            return
+
+        async def _close():
+            for connection in self._connections:
+                if connection.websocket is not None:
+                    await connection.websocket.close()
+
+        asyncio.run_coroutine_threadsafe(_close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def aclose(self):
+        """close() for a pool opened with attach()."""
+        self.closed = True
+        for connection in self._connections:
+            if connection.websocket is not None:
+                await connection.websocket.close()